@@ -6,17 +6,27 @@ primarily with communication to/from the API's users."""
 
 
 import logging
+import string
+from datetime import date, datetime
 import endpoints
-import json
 from protorpc import remote, messages, message_types
-from google.appengine.api import memcache
-from google.appengine.api import taskqueue
 
-from models import User, Game, Score, Hangman, UserRecord
-from models import StringMessage, NewGameForm, GameForm, MakeMoveForm,\
+from models import User, Game, Score, UserRecord, ArchivedGame
+from forms import StringMessage, NewGameForm, GameForm, MakeMoveForm,\
     GameForms, ScoreForms, UserRecordForm, UserRecordForms,\
-    GameHistoryForm, CancelGameForm
-from utils import get_by_urlsafe
+    GameHistoryForm, CancelGameForm, BatchNewGameForm, BatchMakeMoveForm,\
+    BatchCancelGameForm, BatchResultForm, BatchResultForms, HintForm,\
+    ListView, ScoreWindow, SubscriptionForm
+from google.appengine.api import datastore_errors
+from google.appengine.ext import ndb
+from utils import get_by_urlsafe, get_key_by_urlsafe, fetch_page,\
+    fetch_keys_page, get_multi_map
+from instrumentation import request_scope
+from ratelimit import rate_limit, shed_load
+import leaderboard
+import movecache
+import push
+import words
 
 NEW_GAME_REQUEST = endpoints.ResourceContainer(NewGameForm)
 GET_GAME_REQUEST = endpoints.ResourceContainer(
@@ -27,12 +37,38 @@ MAKE_MOVE_REQUEST = endpoints.ResourceContainer(
 USER_REQUEST = endpoints.ResourceContainer(user_name=messages.StringField(1),
     email=messages.StringField(2),)
 GET_USER_GAMES_REQUEST = endpoints.ResourceContainer(
-        urlsafe_user_key=messages.StringField(1),)
+        urlsafe_user_key=messages.StringField(1),
+        page_size=messages.IntegerField(2),
+        cursor=messages.StringField(3),
+        view=messages.EnumField(ListView, 4),)
 GET_HIGH_SCORES_REQUEST = endpoints.ResourceContainer(
-        number_of_results=messages.IntegerField(1),)
+        number_of_results=messages.IntegerField(1),
+        page_size=messages.IntegerField(2),
+        cursor=messages.StringField(3),
+        view=messages.EnumField(ListView, 4),
+        window=messages.EnumField(ScoreWindow, 5),
+        date=messages.StringField(6),)
+PAGE_REQUEST = endpoints.ResourceContainer(
+        page_size=messages.IntegerField(1),
+        cursor=messages.StringField(2),)
 
 MEMCACHE_MOVES_REMAINING = 'MOVES_REMAINING'
 
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+MAX_BATCH_SIZE = 100
+
+WINDOWS = {ScoreWindow.DAILY: leaderboard.DAILY,
+           ScoreWindow.WEEKLY: leaderboard.WEEKLY}
+
+
+def _page_size(requested):
+    """Clamps a client-requested page size to the server maximum"""
+    if not requested or requested < 1:
+        return DEFAULT_PAGE_SIZE
+    return min(requested, MAX_PAGE_SIZE)
+
+
 @endpoints.api(name='hangman', version='v1')
 class HangmanApi(remote.Service):
     """Game API"""
@@ -44,25 +80,20 @@ class HangmanApi(remote.Service):
                       path='user',
                       name='create_user',
                       http_method='POST')
+    @request_scope
+    @rate_limit('create_user')
     def create_user(self, request):
         """Create a User. Requires a unique username."""
-        if User.query(User.name == request.user_name).get():
+        if not User.normalize(request.user_name):
+            raise endpoints.BadRequestException("'user_name' field required")
+        # Creates the UserRecord for storing wins, losses, etc. alongside
+        if not User.create(request.user_name, request.email):
             raise endpoints.ConflictException(
                     'A User with that name already exists!')
-        user = User(name=request.user_name, email=request.email)
-        user.put()
-        # Create the UserRecord for storing wins, losses, etc.
-        self._create_user_record(user)
         return StringMessage(message='User {} created!'.format(
                 request.user_name))
 
 
-    def _create_user_record(self, user):
-        # Create a UserRecord from the created User
-        user_record = UserRecord(user=user.key)
-        user_record.put()
-
-
 # - - - Game Actions - - - - - - - - - - - - - - - - - - - -
 
     @endpoints.method(request_message=NEW_GAME_REQUEST,
@@ -70,15 +101,37 @@ class HangmanApi(remote.Service):
                       path='game',
                       name='new_game',
                       http_method='POST')
+    @request_scope
+    @rate_limit('new_game')
     def new_game(self, request):
         """Creates new game."""
-        user = User.query(User.name == request.user_name).get()
+        if not User.normalize(request.user_name):
+            raise endpoints.BadRequestException("'user_name' field required")
+        user = User.get_by_name(request.user_name)
         if not user:
             raise endpoints.NotFoundException(
                     'A User with that name does not exist!')
 
+        game = Game.new_game(user.key, self._choose_word(request))
+        # the User is at hand, so the form needs no lookup
+        return game._to_form(user, 'Good luck playing Hangman!')
+
+
+    def _choose_word(self, request):
+        # Use the caller's word, or pick one from the dictionary
+        if request.word:
+            return self._clean_word(request.word)
+        difficulty = request.difficulty.name if request.difficulty else None
+        word = words.choose(request.word_length, difficulty)
+        if not word:
+            raise endpoints.BadRequestException(
+                    'No dictionary word matches that word_length/difficulty')
+        return word
+
+
+    def _clean_word(self, word):
         # remove any leading or trailing spaces
-        word_stripped = request.word.strip()
+        word_stripped = word.strip()
         if not word_stripped:
             raise endpoints.BadRequestException("Hangman 'word' field required")
 
@@ -87,8 +140,9 @@ class HangmanApi(remote.Service):
         if len(word_list) > 1:
             raise endpoints.BadRequestException("Hangman 'word' field must be a single word")
 
-        game = Game.new_game(user.key, word_stripped)
-        return game.to_form('Good luck playing Hangman!')
+        if not any(char in string.ascii_uppercase for char in word_stripped.upper()):
+            raise endpoints.BadRequestException("Hangman 'word' field must contain a letter")
+        return word_stripped
 
 
     @endpoints.method(request_message=GET_GAME_REQUEST,
@@ -96,68 +150,159 @@ class HangmanApi(remote.Service):
                       path='game/{urlsafe_game_key}',
                       name='get_game',
                       http_method='GET')
+    @request_scope
     def get_game(self, request):
         """Return the current game state."""
-        game = get_by_urlsafe(request.urlsafe_game_key, Game)
+        game = self._get_live_game(request.urlsafe_game_key)
         if game:
             return game.to_form('Time to make a guess!')
         else:
             raise endpoints.NotFoundException('Game not found!')
 
+    @endpoints.method(request_message=GET_GAME_REQUEST,
+                      response_message=SubscriptionForm,
+                      path='game/{urlsafe_game_key}/subscribe',
+                      name='subscribe_game',
+                      http_method='POST')
+    @request_scope
+    def subscribe_game(self, request):
+        """Subscribe to pushed state updates of a game instead of polling
+        get_game. Returns the channel to listen on and the current state."""
+        if not push.enabled():
+            raise endpoints.BadRequestException('Push updates are disabled')
+        game = self._get_live_game(request.urlsafe_game_key)
+        if not game:
+            raise endpoints.NotFoundException('Game not found!')
+        client_id, token = push.subscribe(game.key)
+        # a move made before the subscription was stored is covered by the
+        # next update, which carries the whole state
+        return SubscriptionForm(client_id=client_id, token=token,
+                                game=game.to_form('Subscribed to game updates'))
+
+
     @endpoints.method(request_message=MAKE_MOVE_REQUEST,
                       response_message=GameForm,
                       path='game/{urlsafe_game_key}',
                       name='make_move',
                       http_method='PUT')
+    @request_scope
+    @rate_limit('make_move')
     def make_move(self, request):
         """Makes a move. Returns a game state with message"""
-        game = get_by_urlsafe(request.urlsafe_game_key, Game)
+        return self._play(request.urlsafe_game_key, lambda game: request.guess)
+
+
+    @endpoints.method(request_message=GET_GAME_REQUEST,
+                      response_message=GameForm,
+                      path='game/{urlsafe_game_key}/auto',
+                      name='auto_move',
+                      http_method='PUT')
+    @request_scope
+    @rate_limit('make_move')
+    def auto_move(self, request):
+        """Lets the solver make the next move. Returns a game state with
+        message"""
+        # NumPy is only loaded once a hint is needed
+        import solver
+        return self._play(request.urlsafe_game_key,
+                          lambda game: solver.hint(game).letter)
+
+
+    @endpoints.method(request_message=GET_GAME_REQUEST,
+                      response_message=HintForm,
+                      path='game/{urlsafe_game_key}/hint',
+                      name='get_hint',
+                      http_method='GET')
+    @request_scope
+    def get_hint(self, request):
+        """Return the solver's pick for the next guess."""
+        game = self._get_live_game(request.urlsafe_game_key)
+        if not game:
+            raise endpoints.NotFoundException('Game not found!')
+        if game.game_over:
+            return HintForm(candidates=0, message='Game already over!')
+        import solver
+        hint = solver.hint(game)
+        return HintForm(letter=hint.letter, candidates=hint.candidates,
+                        message='Try {0}!'.format(hint.letter))
+
+
+    def _play(self, urlsafe_game_key, choose_guess):
+        # Apply the guess choose_guess(game) picks to a game and end the
+        # game if that decides it
+        apply_guess = lambda game: self._apply_guess(game, choose_guess(game))
+        if movecache.enabled():
+            game_key = get_key_by_urlsafe(urlsafe_game_key, Game)
+            game, msg = movecache.update(game_key, apply_guess)
+        else:
+            game = get_by_urlsafe(urlsafe_game_key, Game)
+            msg = None
+            if game and not game.game_over:
+                msg = apply_guess(game)
         if not game:
             raise endpoints.NotFoundException(
                     'Game not found!')
-        if game.game_over:
-            return game.to_form('Game already over!')
+        if msg is None or game.game_over:
+            form = game.to_form(self._end_if_over(game, msg))
+        else:
+            # build the response while the game is being written
+            form = game.to_form_async(msg)
+            if not movecache.enabled():
+                game.put_async().check_success()
+            form = form.get_result()
+        if msg is not None:
+            push.publish([game])
+        return form
+
+
+    def _end_if_over(self, game, msg):
+        # End a game decided by its last guess and return the response
+        # message. msg is None if the game was over before the guess.
+        if msg is None:
+            return 'Game already over!'
+        if not game.game_over:
+            return msg
+        try:
+            ended = game.end_game(game.game_won)
+        except datastore_errors.TransactionFailedError:
+            # nothing of the move was stored, so it can simply be replayed
+            raise endpoints.ConflictException(
+                    'Too many concurrent updates, retry the move')
+        if not ended:
+            return 'Game already over!'
+        movecache.evict(game.key)
+        if game.game_won:
+            return 'You win!'
+        return msg + ' Game over!'
+
+
+    def _apply_guess(self, game, guess):
+        # Apply a guess to the game in memory and return the result message.
+        # A deciding guess marks the game over; the caller ends it.
         # clean incoming guess and validate
-        request_upper = request.guess.upper().strip()
+        request_upper = guess.upper().strip()
         if not request_upper:
             raise endpoints.BadRequestException("Hangman 'guess' field required")
 
         if len(request_upper) > 1:
             raise endpoints.BadRequestException("Hangman 'guess' field must be 1 character")
 
-        if request_upper in game.hits:
-            raise endpoints.BadRequestException("You've already guessed '{0}'".format(request_upper))
+        if request_upper not in string.ascii_uppercase:
+            raise endpoints.BadRequestException("Hangman 'guess' field must be a letter")
 
-        if request_upper in game.misses:
+        if game.is_guessed(request_upper):
             raise endpoints.BadRequestException("You've already guessed '{0}'".format(request_upper))
 
-        if request_upper in game.word:
-            game.hits.append(request_upper)
-            game.match_count += game.word.count(request_upper)
-            msg = 'Hit!'
-        else:
-            game.misses.append(request_upper)
-            miss_count = game.miss_count
-            game.miss_count = miss_count + 1
-            if miss_count < game.guess_limit:
-                img_key = "guess-{0}".format(game.miss_count)
-                game.image_uri = Hangman.DEFAULTS['images'][img_key]
-            msg = 'Miss!'
-
-        # store the result of  the guess in the game's history field
-        move_result = {'Guess':request_upper, 'Result':msg}
-        game.history.append(json.dumps(move_result))
-
-        if game.match_count == len(game.word):
-            game.end_game(True)
-            return game.to_form('You win!')
-
-        if game.miss_count == game.guess_limit:
-            game.end_game(False)
-            return game.to_form(msg + ' Game over!')
-        else:
-            game.put()
-            return game.to_form(msg)
+        msg = 'Hit!' if game.guess(request_upper) else 'Miss!'
+
+        # store the guess in the game's packed move history
+        game.record_move(request_upper)
+
+        if game.is_won():
+            game.game_over = game.game_won = True
+        elif game.is_lost():
+            game.game_over = True
+        return msg
 
 
     @endpoints.method(request_message=GET_USER_GAMES_REQUEST,
@@ -165,15 +310,29 @@ class HangmanApi(remote.Service):
                       path='games/user/{urlsafe_user_key}',
                       name='get_user_games',
                       http_method='GET')
+    @request_scope
     def get_user_games(self, request):
-        """Return active games (by urlsafe_user_key)."""
+        """Return a page of active games (by urlsafe_user_key). With
+        view=SUMMARY, only GameSummaryForms are returned."""
         user = get_by_urlsafe(request.urlsafe_user_key, User)
         if not user:
             raise endpoints.NotFoundException('User not found!')
-        games = Game.query(Game.user==user.key, Game.game_over==False).order(-Game.created)
+        query = Game.query(Game.user==user.key, Game.game_over==False).order(-Game.created)
+        page_size = _page_size(request.page_size)
+        if request.view == ListView.SUMMARY:
+            games, next_cursor = fetch_page(
+                    query, page_size, request.cursor,
+                    projection=Game.SUMMARY_PROJECTION)
+            return GameForms(
+                summaries=[game.to_summary_form(user.name) for game in games],
+                next_cursor=next_cursor
+            )
+        games, next_cursor = fetch_keys_page(query, page_size, request.cursor)
         # return set of GameForm objects per User
+        forms = [game.to_form_async('') for game in games]
         return GameForms(
-            items=[game.to_form('') for game in games]
+            items=[form.get_result() for form in forms],
+            next_cursor=next_cursor
         )
 
 
@@ -182,9 +341,14 @@ class HangmanApi(remote.Service):
                       path='game/cancel/{urlsafe_game_key}',
                       name='cancel_game',
                       http_method='DELETE')
+    @request_scope
     def cancel_game(self, request):
         """Cancel a game (by urlsafe_game_key)."""
-        game = get_by_urlsafe(request.urlsafe_game_key, Game)
+        return self._cancel_game(request.urlsafe_game_key)
+
+
+    def _cancel_game(self, urlsafe_game_key):
+        game = self._get_live_game(urlsafe_game_key)
 
         if not game:
             raise endpoints.NotFoundException('Game not found!')
@@ -194,30 +358,304 @@ class HangmanApi(remote.Service):
                                   message='Cancelling a completed game is not allowed')
 
         game.key.delete()
+        movecache.evict(game.key)
+        push.publish_cancelled([game.key])
         return CancelGameForm(success=True,
                              message='Game is cancelled successfully')
 
 
+# - - - Batch Actions - - - - - - - - - - - - - - - - - - -
+
+    @endpoints.method(request_message=BatchNewGameForm,
+                      response_message=BatchResultForms,
+                      path='games/batch',
+                      name='batch_new_game',
+                      http_method='POST')
+    @request_scope
+    @rate_limit('batch_new_game', cost=lambda request: len(request.items))
+    def batch_new_game(self, request):
+        """Creates several games, resolving all Users with one batched get
+        and writing all Games with one put_multi."""
+        self._check_batch_size(request.items)
+        users = User.get_multi_by_name(item.user_name for item in request.items)
+        results = []
+        games = []
+        for item in request.items:
+            user = users[item.user_name]
+            try:
+                if not User.normalize(item.user_name):
+                    raise endpoints.BadRequestException(
+                            "'user_name' field required")
+                if not user:
+                    raise endpoints.NotFoundException(
+                            'A User with that name does not exist!')
+                game = Game.build(user.key, self._choose_word(item))
+            except endpoints.ServiceException, e:
+                results.append(BatchResultForm(success=False,
+                                               message=str(e)))
+                continue
+            games.append(game)
+            results.append(game)
+        ndb.put_multi(games)
+        return self._batch_results(results, 'Good luck playing Hangman!')
+
+
+    @endpoints.method(request_message=BatchMakeMoveForm,
+                      response_message=BatchResultForms,
+                      path='games/batch/moves',
+                      name='batch_make_move',
+                      http_method='PUT')
+    @request_scope
+    @rate_limit('batch_make_move', cost=lambda request: len(request.items))
+    def batch_make_move(self, request):
+        """Makes several moves in order. All Games are read with one
+        batched get, moves are applied in memory and the Games still in
+        progress are written with one put_multi."""
+        self._check_batch_size(request.items)
+        if movecache.enabled():
+            # live state is in memcache, apply the moves one by one there
+            return BatchResultForms(items=[
+                self._batch_item(self._buffered_move, item)
+                for item in request.items])
+
+        keys = []
+        for item in request.items:
+            try:
+                keys.append(get_key_by_urlsafe(item.urlsafe_game_key, Game))
+            except (endpoints.ServiceException, ValueError):
+                keys.append(None)
+        games = get_multi_map(keys)
+        users = get_multi_map(game.user for game in games.values() if game)
+
+        # Several items may target the same Game, so each item's message
+        # and form are taken right after its own guess; only the item whose
+        # guess decided a game ends it.
+        items = []
+        played = []
+        changed = {}
+        decided = []
+        for key, item in zip(keys, request.items):
+            game = games.get(key)
+            if not game:
+                items.append(BatchResultForm(success=False,
+                                             message='Game not found!'))
+                continue
+            if game.game_over:
+                items.append(BatchResultForm(
+                    success=True, message='Game already over!',
+                    game=game._to_form(users[game.user], 'Game already over!')))
+                played.append((game.key, items[-1]))
+                continue
+            try:
+                msg = self._apply_guess(game, item.guess)
+            except endpoints.ServiceException, e:
+                items.append(BatchResultForm(success=False, message=str(e)))
+                continue
+            changed[game.key] = game
+            items.append(BatchResultForm(
+                success=True, message=msg,
+                game=game._to_form(users[game.user], msg)))
+            played.append((game.key, items[-1]))
+            if game.game_over:
+                decided.append((game, items[-1]))
+
+        # decided games end in their own transaction while the rest are
+        # written with one put
+        puts = ndb.put_multi_async([changed_game
+                                    for changed_game in changed.values()
+                                    if not changed_game.game_over])
+        for game, result in decided:
+            try:
+                result.message = self._end_if_over(game, result.message)
+            except endpoints.ServiceException, e:
+                # none of the game's moves in this batch were stored
+                for game_key, played_result in played:
+                    if game_key == game.key:
+                        played_result.success = False
+                        played_result.message = str(e)
+                        played_result.game = None
+                del changed[game.key]
+                continue
+            result.game.message = result.message
+        ndb.Future.wait_all(puts)
+        for put in puts:
+            put.check_success()
+        push.publish(changed.values())
+        return BatchResultForms(items=items)
+
+
+    def _buffered_move(self, item):
+        game_key = get_key_by_urlsafe(item.urlsafe_game_key, Game)
+        game, msg = movecache.update(
+                game_key, lambda game: self._apply_guess(game, item.guess))
+        if not game:
+            raise endpoints.NotFoundException('Game not found!')
+        form = game.to_form(self._end_if_over(game, msg))
+        if msg is not None:
+            push.publish([game])
+        return form
+
+
+    @endpoints.method(request_message=BatchCancelGameForm,
+                      response_message=BatchResultForms,
+                      path='games/batch/cancel',
+                      name='batch_cancel_game',
+                      http_method='POST')
+    @request_scope
+    def batch_cancel_game(self, request):
+        """Cancels several games with one batched get and one
+        delete_multi."""
+        self._check_batch_size(request.urlsafe_game_keys)
+        if movecache.enabled():
+            return BatchResultForms(items=[
+                self._batch_item(self._cancel_game, urlsafe_key)
+                for urlsafe_key in request.urlsafe_game_keys])
+
+        keys = []
+        for urlsafe_key in request.urlsafe_game_keys:
+            try:
+                keys.append(get_key_by_urlsafe(urlsafe_key, Game))
+            except (endpoints.ServiceException, ValueError):
+                keys.append(None)
+        games = get_multi_map(keys)
+
+        results = []
+        cancelled = set()
+        for key in keys:
+            game = games.get(key)
+            if not game:
+                results.append(BatchResultForm(success=False,
+                                               message='Game not found!'))
+            elif game.game_over:
+                results.append(BatchResultForm(success=False,
+                        message='Cancelling a completed game is not allowed'))
+            else:
+                cancelled.add(key)
+                results.append(BatchResultForm(success=True,
+                        message='Game is cancelled successfully'))
+        ndb.delete_multi(cancelled)
+        push.publish_cancelled(cancelled)
+        return BatchResultForms(items=results)
+
+
+    def _check_batch_size(self, items):
+        if len(items) > MAX_BATCH_SIZE:
+            raise endpoints.BadRequestException(
+                    'At most {0} items per batch'.format(MAX_BATCH_SIZE))
+
+
+    def _batch_item(self, function, item):
+        # Run a single-item operation, turning its outcome into a result
+        try:
+            response = function(item)
+        except (endpoints.ServiceException, ValueError), e:
+            return BatchResultForm(success=False, message=str(e))
+        if isinstance(response, CancelGameForm):
+            return BatchResultForm(success=response.success,
+                                   message=response.message)
+        return BatchResultForm(success=True, message=response.message,
+                               game=response)
+
+
+    def _batch_results(self, results, message=None):
+        # Resolve the GameForms of a batch concurrently. results holds a
+        # failed BatchResultForm or a Game per item.
+        pending = [result if isinstance(result, BatchResultForm)
+                   else result.to_form_async(message) for result in results]
+        items = []
+        for result in pending:
+            if isinstance(result, BatchResultForm):
+                items.append(result)
+            else:
+                items.append(BatchResultForm(success=True, message=message,
+                                             game=result.get_result()))
+        return BatchResultForms(items=items)
+
+
     @endpoints.method(request_message=GET_HIGH_SCORES_REQUEST,
                       response_message=ScoreForms,
                       path='scores',
                       name='get_high_scores',
                       http_method='GET')
+    @request_scope
+    @shed_load(lambda request: bool(request.cursor))
     def get_high_scores(self, request):
-        """Return high scores, optionally by number_of_requests."""
-        if request.number_of_results:
-            return ScoreForms(items=[score.to_form() for score in Score.query().order(-Score.score).fetch(request.number_of_results)])
-        else:
-            return ScoreForms(items=[score.to_form() for score in Score.query().order(-Score.score)])
-
-
-    @endpoints.method(response_message=UserRecordForms,
+        """Return a page of high scores, sized by number_of_results or
+        page_size. With view=SUMMARY, only ScoreSummaryForms are returned.
+        Cursors only continue a listing of the same view. A DAILY or WEEKLY
+        window lists the best scores of the day or week holding date
+        (YYYY-MM-DD, today by default), from rollups, in a single page."""
+        page_size = _page_size(request.number_of_results or request.page_size)
+        if request.window in WINDOWS:
+            return self._window_scores(request, page_size)
+        if request.view == ListView.SUMMARY:
+            # every page comes from the projection query: its index orders
+            # tied scores by the projected properties, not as the snapshot
+            scores, next_cursor = fetch_page(
+                    Score.query().order(-Score.score), page_size,
+                    request.cursor, projection=Score.SUMMARY_PROJECTION)
+            return ScoreForms(summaries=Score.to_summary_forms(scores),
+                              next_cursor=next_cursor)
+        if not request.cursor:
+            items, next_cursor = self._leaderboard_page(
+                    leaderboard.SCORES, page_size)
+            return ScoreForms(items=items, next_cursor=next_cursor)
+        scores, next_cursor = fetch_keys_page(Score.query().order(-Score.score),
+                                              page_size, request.cursor)
+        return ScoreForms(items=Score.to_forms(scores),
+                          next_cursor=next_cursor)
+
+
+    @endpoints.method(request_message=PAGE_REQUEST,
+                      response_message=UserRecordForms,
                       path='ranking',
                       name='get_user_rankings',
                       http_method='GET')
+    @request_scope
+    @shed_load(lambda request: bool(request.cursor))
     def get_user_rankings(self, request):
-        """Return user rankings sorted by wins, then win percentage."""
-        return UserRecordForms(items=[rank.to_form() for rank in UserRecord.query().order(-UserRecord.wins, -UserRecord.win_pct)])
+        """Return a page of user rankings sorted by wins, then win
+        percentage."""
+        page_size = _page_size(request.page_size)
+        if not request.cursor:
+            items, next_cursor = self._leaderboard_page(
+                    leaderboard.RANKINGS, page_size)
+            return UserRecordForms(items=items, next_cursor=next_cursor)
+        query = UserRecord.query().order(-UserRecord.wins, -UserRecord.win_pct)
+        records, next_cursor = fetch_keys_page(query, page_size,
+                                               request.cursor)
+        return UserRecordForms(items=UserRecord.to_forms(records),
+                               next_cursor=next_cursor)
+
+
+    def _window_scores(self, request, page_size):
+        if request.cursor:
+            raise endpoints.BadRequestException(
+                    'Windowed high scores are not paged')
+        day = date.today()
+        if request.date:
+            try:
+                day = datetime.strptime(request.date, '%Y-%m-%d').date()
+            except ValueError:
+                raise endpoints.BadRequestException(
+                        'date must be formatted as YYYY-MM-DD')
+        entries = leaderboard.window_entries(WINDOWS[request.window], day)
+        if request.view == ListView.SUMMARY:
+            return ScoreForms(summaries=leaderboard.to_forms(
+                    leaderboard.SCORES, entries[:page_size], summary=True))
+        return ScoreForms(items=leaderboard.to_forms(leaderboard.SCORES,
+                                                     entries[:page_size]))
+
+
+    def _leaderboard_page(self, board, page_size):
+        # Serve the first page from the materialized snapshot. Only when
+        # more rows exist is a keys-only page run, to hand out a cursor.
+        entries = leaderboard.get_entries(board)
+        next_cursor = None
+        if len(entries) > page_size or leaderboard.is_saturated(entries):
+            _, next_cursor = fetch_page(leaderboard.board_query(board),
+                                        page_size, keys_only=True)
+        return leaderboard.to_forms(board, entries[:page_size]), next_cursor
 
 
     @endpoints.method(request_message=GET_GAME_REQUEST,
@@ -225,13 +663,28 @@ class HangmanApi(remote.Service):
                       path='game_history/{urlsafe_game_key}',
                       name='get_game_history',
                       http_method='GET')
+    @request_scope
     def get_game_history(self, request):
         """Return the history of game moves."""
-        game = get_by_urlsafe(request.urlsafe_game_key, Game)
+        game_key = get_key_by_urlsafe(request.urlsafe_game_key, Game)
+        archived_key = ArchivedGame.key_for(game_key)
+        if movecache.enabled():
+            game = movecache.get(game_key) or archived_key.get()
+        else:
+            # the live and the archived Game are read in one batch
+            game, archived = ndb.get_multi([game_key, archived_key])
+            game = game or archived
         if game:
             return game.to_history_form()
         else:
             raise endpoints.NotFoundException('Game not found!')
 
 
+    def _get_live_game(self, urlsafe_game_key):
+        # Games in progress may be ahead of the datastore in write-behind mode
+        if movecache.enabled():
+            return movecache.get(get_key_by_urlsafe(urlsafe_game_key, Game))
+        return get_by_urlsafe(urlsafe_game_key, Game)
+
+
 api = endpoints.api_server([HangmanApi])
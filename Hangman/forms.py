@@ -0,0 +1,187 @@
+"""forms.py - This file contains the protorpc message definitions (forms)
+the API exchanges. They are kept apart from the Datastore entities in
+models.py so that code which only needs the entities, like the cron and
+task handlers, doesn't load protorpc."""
+
+from protorpc import messages
+
+
+class GameForm(messages.Message):
+    """GameForm for outbound game state information"""
+    urlsafe_key = messages.StringField(1, required=True)
+    # only set once the game is over
+    word = messages.StringField(2)
+    miss_count = messages.IntegerField(3)
+    game_over = messages.BooleanField(4, required=True)
+    message = messages.StringField(5, required=True)
+    user_name = messages.StringField(6, required=True)
+    created = messages.StringField(7, required=True)
+    guesses = messages.IntegerField(8)
+    hits = messages.StringField(9, repeated=True)
+    misses = messages.StringField(10, repeated=True)
+    image_uri = messages.StringField(11)
+    guess_limit = messages.IntegerField(12)
+    match_count = messages.IntegerField(13)
+    game_won = messages.BooleanField(14)
+    masked_word = messages.StringField(15)
+
+
+class GameSummaryForm(messages.Message):
+    """GameSummaryForm for listing games without their hits and misses"""
+    urlsafe_key = messages.StringField(1, required=True)
+    user_name = messages.StringField(2, required=True)
+    created = messages.StringField(3, required=True)
+    word_length = messages.IntegerField(4)
+    miss_count = messages.IntegerField(5)
+    match_count = messages.IntegerField(6)
+    guess_limit = messages.IntegerField(7)
+
+
+class GameForms(messages.Message):
+    """Return multiple GameForms, or GameSummaryForms for summary listings"""
+    items = messages.MessageField(GameForm, 1, repeated=True)
+    next_cursor = messages.StringField(2)
+    summaries = messages.MessageField(GameSummaryForm, 3, repeated=True)
+
+
+class ScoreWindow(messages.Enum):
+    """Time window of a high score listing"""
+    ALL_TIME = 1
+    WEEKLY = 2
+    DAILY = 3
+
+
+class ListView(messages.Enum):
+    """Level of detail of a listing"""
+    FULL = 1
+    SUMMARY = 2
+
+
+class GameHistoryForm(messages.Message):
+    """GameHistoryForm for outbound game state information"""
+    # only set once the game is over
+    word = messages.StringField(1)
+    history = messages.StringField(2, repeated=True)
+    game_over = messages.BooleanField(3)
+    game_won = messages.BooleanField(4)
+
+
+class CancelGameForm(messages.Message):
+    success = messages.BooleanField(1, required=True)
+    message = messages.StringField(2, required=True)
+
+
+class Difficulty(messages.Enum):
+    """Difficulty of a dictionary word"""
+    EASY = 1
+    MEDIUM = 2
+    HARD = 3
+
+
+class NewGameForm(messages.Message):
+    """Used to create a new game. Without a word, the server picks one from
+    its dictionary, optionally by length and/or difficulty."""
+    user_name = messages.StringField(1, required=True)
+    word = messages.StringField(2)
+    word_length = messages.IntegerField(3)
+    difficulty = messages.EnumField(Difficulty, 4)
+
+
+class MakeMoveForm(messages.Message):
+    """Used to make a move in an existing game"""
+    guess = messages.StringField(1, required=True)
+
+
+class BatchNewGameForm(messages.Message):
+    """Used to create several games at once"""
+    items = messages.MessageField(NewGameForm, 1, repeated=True)
+
+
+class BatchMoveForm(messages.Message):
+    """A single move of a BatchMakeMoveForm"""
+    urlsafe_game_key = messages.StringField(1, required=True)
+    guess = messages.StringField(2, required=True)
+
+
+class BatchMakeMoveForm(messages.Message):
+    """Used to make several moves, in order, in one or more games"""
+    items = messages.MessageField(BatchMoveForm, 1, repeated=True)
+
+
+class BatchCancelGameForm(messages.Message):
+    """Used to cancel several games at once"""
+    urlsafe_game_keys = messages.StringField(1, repeated=True)
+
+
+class BatchResultForm(messages.Message):
+    """Outcome of one item of a batch request"""
+    success = messages.BooleanField(1, required=True)
+    message = messages.StringField(2, required=True)
+    game = messages.MessageField(GameForm, 3)
+
+
+class BatchResultForms(messages.Message):
+    """Outcomes of a batch request, in request order"""
+    items = messages.MessageField(BatchResultForm, 1, repeated=True)
+
+
+class ScoreForm(messages.Message):
+    """ScoreForm for outbound Score information"""
+    user_name = messages.StringField(1, required=True)
+    date = messages.StringField(2, required=True)
+    won = messages.BooleanField(3, required=True)
+    guess_limit = messages.IntegerField(4, required=True)
+    miss_count = messages.IntegerField(5, required=True)
+    word_count = messages.IntegerField(6, required=True)
+    score = messages.IntegerField(7, required=True)
+    word = messages.StringField(8, required=True)
+
+
+class ScoreSummaryForm(messages.Message):
+    """ScoreSummaryForm for listing scores without their game details"""
+    user_name = messages.StringField(1, required=True)
+    date = messages.StringField(2, required=True)
+    won = messages.BooleanField(3, required=True)
+    score = messages.IntegerField(4, required=True)
+
+
+class ScoreForms(messages.Message):
+    """Return multiple ScoreForms, or ScoreSummaryForms for summary listings"""
+    items = messages.MessageField(ScoreForm, 1, repeated=True)
+    next_cursor = messages.StringField(2)
+    summaries = messages.MessageField(ScoreSummaryForm, 3, repeated=True)
+
+
+class UserRecordForm(messages.Message):
+    """UserRecordForm for outbound UserRecord information"""
+    user_name = messages.StringField(1, required=True)
+    games = messages.IntegerField(2, required=True)
+    wins = messages.IntegerField(3, required=True)
+    losses = messages.IntegerField(4, required=True)
+    win_pct = messages.StringField(5, required=True)
+
+
+class UserRecordForms(messages.Message):
+    """Return multiple UserRecordForms"""
+    items = messages.MessageField(UserRecordForm, 1, repeated=True)
+    next_cursor = messages.StringField(2)
+
+
+class HintForm(messages.Message):
+    """HintForm for an outbound solver hint"""
+    letter = messages.StringField(1)
+    candidates = messages.IntegerField(2, required=True)
+    message = messages.StringField(3, required=True)
+
+
+class SubscriptionForm(messages.Message):
+    """SubscriptionForm for an outbound push subscription. Open the channel
+    with token; game is the state to apply pushed updates to."""
+    client_id = messages.StringField(1, required=True)
+    token = messages.StringField(2, required=True)
+    game = messages.MessageField(GameForm, 3, required=True)
+
+
+class StringMessage(messages.Message):
+    """StringMessage-- outbound (single) string message"""
+    message = messages.StringField(1, required=True)
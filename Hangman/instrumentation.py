@@ -0,0 +1,237 @@
+"""instrumentation.py - Request scoping and hot-path instrumentation for the
+HangmanApi endpoints and the cron/task handlers. Every endpoint starts with
+an empty ndb in-context cache, so within one request the cache acts as an
+identity map and no entity is fetched from the datastore twice.
+
+Each instrumented request records its wall time, the datastore gets, puts,
+queries and deletes it issued with their latencies, memcache hits and misses
+and the size of its serialized response. The figures are aggregated per
+endpoint into in-memory histograms (per instance) that the admin-only
+/admin/stats handler exposes. A sampled fraction of requests can also run
+under cProfile; the rate is toggled through memcache so that every instance
+picks it up."""
+
+import cProfile
+import collections
+import functools
+import logging
+import pstats
+import random
+import StringIO
+import threading
+import time
+
+from google.appengine.api import apiproxy_stub_map
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+
+MEMCACHE_PROFILE_RATE = 'INSTRUMENTATION_PROFILE_RATE'
+# seconds an instance caches the profile sampling rate
+PROFILE_RATE_TTL = 60
+# fraction of endpoint responses encoded once more to measure their size
+SIZE_SAMPLE_RATE = 0.1
+# profiles kept per endpoint
+PROFILES_KEPT = 5
+# upper bounds, in ms, of the wall time histogram buckets
+LATENCY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+DATASTORE_CALLS = {
+    'Get': 'get',
+    'Put': 'put',
+    'RunQuery': 'query',
+    'Next': 'query',
+    'Delete': 'delete',
+}
+
+_local = threading.local()
+_lock = threading.Lock()
+_profile_rate = {'value': 0.0, 'expires': 0}
+# requests being served by this instance right now
+_in_flight = {'value': 0}
+
+
+class EndpointStats(object):
+    """Aggregated figures of one endpoint or handler"""
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.wall_ms = 0.0
+        self.histogram = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.rpcs = collections.Counter()
+        self.rpc_ms = collections.Counter()
+        self.memcache = collections.Counter()
+        self.response_bytes = 0
+        self.sized_responses = 0
+        self.profiles = collections.deque(maxlen=PROFILES_KEPT)
+
+    def add(self, request_stats, wall_ms, failed):
+        self.requests += 1
+        self.errors += int(failed)
+        self.wall_ms += wall_ms
+        bucket = 0
+        while bucket < len(LATENCY_BUCKETS) and wall_ms > LATENCY_BUCKETS[bucket]:
+            bucket += 1
+        self.histogram[bucket] += 1
+        self.rpcs.update(request_stats.rpcs)
+        self.rpc_ms.update(request_stats.rpc_ms)
+        self.memcache.update(request_stats.memcache)
+        if request_stats.response_bytes is not None:
+            self.response_bytes += request_stats.response_bytes
+            self.sized_responses += 1
+        if request_stats.profile:
+            self.profiles.append(request_stats.profile)
+
+    def to_dict(self):
+        bounds = ['<={}ms'.format(bound) for bound in LATENCY_BUCKETS]
+        return {
+            'requests': self.requests,
+            'errors': self.errors,
+            'mean_ms': round(self.wall_ms / self.requests, 3),
+            'histogram': dict(zip(bounds + ['>5000ms'], self.histogram)),
+            'datastore_rpcs': dict(self.rpcs),
+            'datastore_ms': dict((call, round(ms, 3))
+                                 for call, ms in self.rpc_ms.items()),
+            'memcache': dict(self.memcache),
+            'mean_response_bytes': (self.response_bytes / self.sized_responses
+                                    if self.sized_responses else None),
+            'profiles': list(self.profiles),
+        }
+
+
+class RequestStats(object):
+    """Figures collected while one request runs"""
+
+    def __init__(self):
+        self.rpcs = collections.Counter()
+        self.rpc_ms = collections.Counter()
+        self.memcache = collections.Counter()
+        self.started = {}
+        self.response_bytes = None
+        self.profile = None
+
+
+# endpoint or handler name -> EndpointStats
+stats = collections.defaultdict(EndpointStats)
+
+
+def _before_rpc(service, call, request, response, rpc):
+    request_stats = getattr(_local, 'request', None)
+    if request_stats is not None and service == 'datastore_v3':
+        request_stats.started[id(rpc)] = time.time()
+
+
+def _after_rpc(service, call, request, response, rpc):
+    request_stats = getattr(_local, 'request', None)
+    if request_stats is None:
+        return
+    if service == 'datastore_v3':
+        kind = DATASTORE_CALLS.get(call, 'other')
+        request_stats.rpcs[kind] += 1
+        started = request_stats.started.pop(id(rpc), None)
+        if started is not None:
+            request_stats.rpc_ms[kind] += (time.time() - started) * 1000.0
+    elif service == 'memcache' and call == 'Get':
+        hits = response.item_size()
+        request_stats.memcache['hits'] += hits
+        request_stats.memcache['misses'] += request.key_size() - hits
+
+apiproxy_stub_map.apiproxy.GetPreCallHooks().Append(
+    'hangman_instrumentation', _before_rpc)
+apiproxy_stub_map.apiproxy.GetPostCallHooks().Append(
+    'hangman_instrumentation', _after_rpc)
+
+
+def get_profile_rate():
+    """Returns the fraction of requests to profile, cached per instance"""
+    now = time.time()
+    if now >= _profile_rate['expires']:
+        _profile_rate['value'] = memcache.get(MEMCACHE_PROFILE_RATE) or 0.0
+        _profile_rate['expires'] = now + PROFILE_RATE_TTL
+    return _profile_rate['value']
+
+
+def set_profile_rate(rate):
+    """Sets the fraction of requests profiled on every instance"""
+    memcache.set(MEMCACHE_PROFILE_RATE, rate)
+    _profile_rate['expires'] = 0
+
+
+def snapshot():
+    """Returns the aggregated figures of this instance"""
+    with _lock:
+        return dict((name, endpoint_stats.to_dict())
+                    for name, endpoint_stats in stats.items())
+
+
+def reset():
+    with _lock:
+        stats.clear()
+
+
+def in_flight():
+    """Returns the number of instrumented requests this instance is serving"""
+    return _in_flight['value']
+
+
+def _run(name, function, args, size_of=None):
+    profiler = None
+    if random.random() < get_profile_rate():
+        profiler = cProfile.Profile()
+    request_stats = _local.request = RequestStats()
+    start = time.time()
+    failed = True
+    with _lock:
+        _in_flight['value'] += 1
+    try:
+        if profiler:
+            result = profiler.runcall(function, *args)
+        else:
+            result = function(*args)
+        failed = False
+        return result
+    finally:
+        wall_ms = (time.time() - start) * 1000.0
+        with _lock:
+            _in_flight['value'] -= 1
+        _local.request = None
+        if not failed and size_of and random.random() < SIZE_SAMPLE_RATE:
+            request_stats.response_bytes = size_of(result)
+        if profiler:
+            output = StringIO.StringIO()
+            pstats.Stats(profiler, stream=output).sort_stats(
+                'cumulative').print_stats(20)
+            request_stats.profile = output.getvalue()
+        with _lock:
+            stats[name].add(request_stats, wall_ms, failed)
+        logging.debug('%s: %.1fms, datastore RPCs %s', name, wall_ms,
+                      dict(request_stats.rpcs))
+
+
+def request_scope(method):
+    """Decorates an endpoint method: records its figures under the method
+    name. The ndb in-context cache is cleared first; App Engine gives every
+    request its own context anyway, but calls made in-process, as by the
+    benchmarks, would otherwise share one."""
+    # only endpoint modules use this, and they have loaded protorpc already
+    from protorpc import protojson
+
+    @functools.wraps(method)
+    def wrapper(self, request):
+        ndb.get_context().clear_cache()
+        return _run(method.__name__, method, (self, request),
+                    size_of=lambda response: len(
+                        protojson.encode_message(response)))
+    return wrapper
+
+
+def instrument_handler(handler_class):
+    """Class decorator for webapp2 handlers: records each dispatched request
+    under the handler's class name"""
+    dispatch = handler_class.dispatch
+
+    def instrumented_dispatch(self):
+        ndb.get_context().clear_cache()
+        return _run(handler_class.__name__, dispatch, (self,))
+    handler_class.dispatch = instrumented_dispatch
+    return handler_class
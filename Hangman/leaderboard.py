@@ -0,0 +1,338 @@
+"""leaderboard.py - Materialized top-N leaderboards. A denormalized snapshot
+of the best Scores and of the best UserRecords (user names and word stats
+already embedded) is kept in a single Leaderboard entity per board, updated
+incrementally from the games that ended and served from memcache with the
+datastore as fallback.
+
+Ending a game only queues its result (a pull task added in the transaction
+that stores the Score); a merge task scheduled every MERGE_SECONDS folds
+the queued results into the boards in one transaction per board, so a burst
+of game endings costs a handful of writes instead of contending for the
+board entities. A batch that fails stays queued and is merged again.
+
+Daily and weekly high scores are rolled up the same way into one
+ScoreRollup entity per day, which a cron compacts into one entity per week
+once the days fall out of DAILY_RETENTION_DAYS."""
+
+import collections
+import json
+import logging
+import time
+from datetime import timedelta
+
+from google.appengine.api import memcache, taskqueue
+from google.appengine.ext import ndb
+
+from models import Score, UserRecord
+
+# Number of entries kept in each snapshot
+TOP_N = 100
+
+SCORES = 'scores'
+RANKINGS = 'rankings'
+
+MEMCACHE_LEADERBOARD = 'LEADERBOARD_{}'
+
+# Score windows served from rollups
+DAILY = 'daily'
+WEEKLY = 'weekly'
+
+# Days for which daily rollups are kept before being compacted into weeks
+DAILY_RETENTION_DAYS = 14
+
+# Pull queue holding the results not merged yet, and the push queue and URL
+# of the task merging them
+PENDING_QUEUE = 'leaderboard'
+MERGE_QUEUE = 'maintenance'
+MERGE_URL = '/tasks/merge_leaderboards'
+# Most seconds between a game ending and its result being merged
+MERGE_SECONDS = 10
+# Results merged per batch, and how long a batch is leased for
+MERGE_BATCH = 100
+MERGE_LEASE_SECONDS = 60
+
+
+class Leaderboard(ndb.Model):
+    """Denormalized top-N snapshot, keyed by board name"""
+    entries = ndb.JsonProperty()
+    updated = ndb.DateTimeProperty(auto_now=True)
+
+
+class ScoreRollup(ndb.Model):
+    """Top-N Scores of one day or week, keyed by '{window}-{start date}'.
+    Weeks start on Monday."""
+    window = ndb.StringProperty(required=True)
+    start = ndb.DateProperty(required=True)
+    entries = ndb.JsonProperty()
+    updated = ndb.DateTimeProperty(auto_now=True)
+
+
+def board_query(board):
+    """Returns the ordered query a board materializes"""
+    if board == SCORES:
+        return Score.query().order(-Score.score)
+    return UserRecord.query().order(-UserRecord.wins, -UserRecord.win_pct)
+
+
+def _form_class(board, summary=False):
+    from forms import ScoreForm, ScoreSummaryForm, UserRecordForm
+    if board == SCORES:
+        return ScoreSummaryForm if summary else ScoreForm
+    return UserRecordForm
+
+
+def _key_order(entry):
+    # Ties are ordered by key, as the datastore does: by path, numeric ids
+    # before names. Python 2 orders ints before strings as well.
+    return ndb.Key(urlsafe=entry['key']).pairs()
+
+
+def _sort_key(board):
+    """Returns a sort key matching the order of board_query exactly, so
+    that the snapshot and a cursor into the query agree on every row"""
+    if board == SCORES:
+        return lambda entry: (-entry['score'], _key_order(entry))
+    return lambda entry: (-entry['wins'], -float(entry['win_pct']),
+                          _key_order(entry))
+
+
+def _entry(key, form):
+    """Flattens an outbound form into a snapshot entry"""
+    entry = dict((field.name, getattr(form, field.name))
+                 for field in form.all_fields())
+    entry['key'] = key.urlsafe()
+    return entry
+
+
+def _rebuild(board):
+    """Recomputes a snapshot from the underlying query and stores it"""
+    rows = board_query(board).fetch(TOP_N)
+    if board == SCORES:
+        forms = Score.to_forms(rows)
+    else:
+        forms = UserRecord.to_forms(rows)
+    entries = [_entry(row.key, form) for row, form in zip(rows, forms)]
+    Leaderboard(id=board, entries=entries).put()
+    return entries
+
+
+def get_entries(board):
+    """Returns the snapshot entries of a board, best first. Reads memcache,
+    then the Leaderboard entity, and only rebuilds from the underlying query
+    when neither exists."""
+    key = MEMCACHE_LEADERBOARD.format(board)
+    entries = memcache.get(key)
+    if entries is None:
+        snapshot = Leaderboard.get_by_id(board)
+        entries = snapshot.entries if snapshot else _rebuild(board)
+        memcache.set(key, entries)
+    return entries
+
+
+def to_forms(board, entries, summary=False):
+    """Builds outbound forms, or summary forms where the board has them,
+    from snapshot entries"""
+    form_class = _form_class(board, summary)
+    names = [field.name for field in form_class.all_fields()]
+    return [form_class(**dict((name, entry[name]) for name in names))
+            for entry in entries]
+
+
+def is_saturated(entries):
+    """True if the underlying query may hold rows beyond the snapshot"""
+    return len(entries) >= TOP_N
+
+
+def invalidate(board):
+    """Drops the cached copy of a board. The next read falls back to the
+    Leaderboard entity."""
+    memcache.delete(MEMCACHE_LEADERBOARD.format(board))
+
+
+@ndb.transactional_tasklet
+def _merge_async(board, new_entries):
+    snapshot = yield Leaderboard.get_by_id_async(board)
+    if not snapshot:
+        # nothing to update incrementally, the next read rebuilds it
+        return
+    sort_key = _sort_key(board)
+    new_entries = dict((entry['key'], entry) for entry in new_entries)
+    kept = [e for e in snapshot.entries if e['key'] not in new_entries]
+    entries = sorted(kept + new_entries.values(), key=sort_key)[:TOP_N]
+    if is_saturated(snapshot.entries) and \
+            (not kept or sort_key(entries[-1]) > sort_key(kept[-1])):
+        # rows outside a full snapshot rank below its last unchanged entry,
+        # so one of them may outrank an entry that dropped below it -
+        # rebuild on the next read
+        yield snapshot.key.delete_async()
+        return
+    snapshot.entries = entries
+    yield snapshot.put_async()
+
+
+def week_start(day):
+    """Returns the Monday of the week holding day"""
+    return day - timedelta(days=day.weekday())
+
+
+def rollup_key(window, start):
+    return ndb.Key(ScoreRollup, '{}-{}'.format(window, start.isoformat()))
+
+
+def _merge_entries(entry_lists):
+    """Merges top-N entry lists, dropping duplicates, into one top-N list"""
+    entries = dict((entry['key'], entry)
+                   for entry_list in entry_lists for entry in entry_list or ())
+    return sorted(entries.values(), key=_sort_key(SCORES))[:TOP_N]
+
+
+@ndb.transactional_tasklet
+def _merge_rollup_async(day, new_entries):
+    key = rollup_key(DAILY, day)
+    rollup = yield key.get_async()
+    if not rollup:
+        rollup = ScoreRollup(key=key, window=DAILY, start=day)
+    entries = _merge_entries([rollup.entries, new_entries])
+    if not any(entry in entries for entry in new_entries):
+        # all below the top-N of a full day, nothing to write
+        return
+    rollup.entries = entries
+    yield rollup.put_async()
+
+
+def window_entries(window, day):
+    """Returns the snapshot entries of the day or week holding day, best
+    first. A week is merged from its compacted rollup and any daily rollups
+    not compacted yet, all read in one batch."""
+    if window == DAILY:
+        keys = [rollup_key(DAILY, day)]
+    else:
+        start = week_start(day)
+        keys = [rollup_key(WEEKLY, start)] + \
+               [rollup_key(DAILY, start + timedelta(days=offset))
+                for offset in range(7)]
+    rollups = [rollup for rollup in ndb.get_multi(keys) if rollup]
+    return _merge_entries(rollup.entries for rollup in rollups)
+
+
+@ndb.transactional(xg=True)
+def _compact_week(start):
+    daily_keys = [rollup_key(DAILY, start + timedelta(days=offset))
+                  for offset in range(7)]
+    weekly_key = rollup_key(WEEKLY, start)
+    rollups = ndb.get_multi([weekly_key] + daily_keys)
+    weekly = rollups[0] or ScoreRollup(key=weekly_key, window=WEEKLY,
+                                       start=start)
+    dailies = [rollup for rollup in rollups[1:] if rollup]
+    weekly.entries = _merge_entries([weekly.entries] +
+                                    [daily.entries for daily in dailies])
+    weekly.put()
+    ndb.delete_multi([daily.key for daily in dailies])
+
+
+def compact_rollups(today):
+    """Folds the daily rollups of weeks ending more than
+    DAILY_RETENTION_DAYS before today into weekly rollups. Returns the
+    number of weeks compacted."""
+    cutoff = week_start(today - timedelta(days=DAILY_RETENTION_DAYS))
+    query = ScoreRollup.query(ScoreRollup.window == DAILY,
+                              ScoreRollup.start < cutoff)
+    weeks = set(week_start(rollup.start) for rollup in
+                query.fetch(projection=[ScoreRollup.start]))
+    for start in sorted(weeks):
+        _compact_week(start)
+    return len(weeks)
+
+
+@ndb.tasklet
+def _record_async(scores, user_entries):
+    # scores holds a (date, entry) pair per Score
+    merges = []
+    if scores:
+        by_day = collections.defaultdict(list)
+        for day, entry in scores:
+            by_day[day].append(entry)
+        merges.append(_merge_async(SCORES, [entry for _, entry in scores]))
+        merges += [_merge_rollup_async(day, entries)
+                   for day, entries in by_day.items()]
+    if user_entries:
+        merges.append(_merge_async(RANKINGS, user_entries))
+    yield merges
+    if scores:
+        invalidate(SCORES)
+    if user_entries:
+        invalidate(RANKINGS)
+
+
+def record_score_async(score, user, game):
+    """Merges a newly created Score into the scores board and the rollup of
+    its day"""
+    return _record_async(
+        [(score.date, _entry(score.key, score._to_form(user, game)))], [])
+
+
+def record_user(user_record, user):
+    """Merges an updated UserRecord into the rankings board"""
+    _record_async(
+        [], [_entry(user_record.key, user_record._to_form(user))]).get_result()
+
+
+def queue_result(score_key, merge_user):
+    """Queues the Score of an ended game, and with merge_user its
+    UserRecord, for the next merge. Called in the transaction storing the
+    Score, so a result is queued exactly when it is stored."""
+    payload = json.dumps({'score': score_key.urlsafe(),
+                          'merge_user': merge_user})
+    taskqueue.Queue(PENDING_QUEUE).add(
+        taskqueue.Task(payload=payload, method='PULL'), transactional=True)
+
+
+def schedule_merge():
+    """Makes sure a merge task runs within MERGE_SECONDS. The task is named
+    after its time slot, so the games ending in one slot share it."""
+    now = time.time()
+    slot = int(now) // MERGE_SECONDS
+    try:
+        taskqueue.Task(name='leaderboard-merge-{}'.format(slot),
+                       url=MERGE_URL,
+                       countdown=(slot + 1) * MERGE_SECONDS - now
+                       ).add(MERGE_QUEUE)
+    except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+        pass
+    except taskqueue.Error:
+        # the results stay queued, the cron merges them
+        logging.warning('Could not schedule a leaderboard merge',
+                        exc_info=True)
+
+
+def merge_pending():
+    """Merges the queued results into the boards and rollups, MERGE_BATCH
+    at a time. A batch is only deleted from the queue once merged; one that
+    fails is leased again when its lease expires. Returns the number of
+    results merged."""
+    queue = taskqueue.Queue(PENDING_QUEUE)
+    merged = 0
+    while True:
+        tasks = queue.lease_tasks(MERGE_LEASE_SECONDS, MERGE_BATCH)
+        if not tasks:
+            return merged
+        results = [json.loads(task.payload) for task in tasks]
+        stored = ndb.get_multi([ndb.Key(urlsafe=result['score'])
+                                for result in results])
+        scores = [score for score in stored if score]
+        record_keys = set(UserRecord.key_for(score.user)
+                          for score, result in zip(stored, results)
+                          if score and result['merge_user'])
+        # a user whose record was sharded since is merged by the fold cron
+        records = [record for record in ndb.get_multi(list(record_keys))
+                   if record and not record.shards]
+        _record_async(
+            [(score.date, _entry(score.key, form))
+             for score, form in zip(scores, Score.to_forms(scores))],
+            [_entry(record.key, form)
+             for record, form in zip(records, UserRecord.to_forms(records))]
+        ).get_result()
+        queue.delete_tasks(tasks)
+        merged += len(tasks)
+        if len(tasks) < MERGE_BATCH:
+            return merged
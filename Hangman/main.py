@@ -2,39 +2,398 @@
 
 """main.py - This file contains handlers that are called by taskqueue and/or
 cronjobs."""
+import json
 import logging
+from datetime import date, datetime, timedelta
 
 import webapp2
-from google.appengine.api import mail, app_identity
-from models import User, Game
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+from models import User, Game, Score, UserRecord, ArchivedGame, Hangman
+from utils import fetch_page
+from instrumentation import instrument_handler
+import instrumentation
+import leaderboard
+import movecache
+import push
 
 
+REMINDER_QUEUE = 'reminders'
+MAINTENANCE_QUEUE = 'maintenance'
+MEMCACHE_REMINDER_SENT = 'REMINDER_SENT_{}_{}'
+# runs start hourly, markers only need to outlive the retries of one run
+REMINDER_MARKER_TTL = 2 * 60 * 60
+
+
+def _add_named_task(name, url, params, queue_name=REMINDER_QUEUE):
+    """Enqueues a task, on the reminder queue by default. Task names make
+    the add idempotent, so a retried fan-out step never enqueues a page
+    twice."""
+    try:
+        taskqueue.Task(name=name, url=url, params=params).add(queue_name)
+    except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+        logging.info('Task %s already enqueued', name)
+
+
+@instrument_handler
 class SendReminderEmail(webapp2.RequestHandler):
     def get(self):
-        """Send a reminder email to each User with an email who
-        has any active games.
+        """Start a reminder run: page through the Users and send each one
+        with an email a digest of their active games.
         Called every 1 hour using a cron job"""
+        run_id = datetime.utcnow().strftime('%Y%m%d%H')
+        _add_named_task('reminders-{}-page-0'.format(run_id),
+                        '/tasks/reminders/fan_out',
+                        {'run_id': run_id, 'page': 0})
+
+
+@instrument_handler
+class FanOutReminders(webapp2.RequestHandler):
+    PAGE_SIZE = 100
+
+    def post(self):
+        """Enqueue a send task for one page of Users, then a fan-out task
+        for the following page. Users without an email are skipped by the
+        send task; filtering on email here would make a multi-query, which
+        can't be paged with cursors."""
+        run_id = self.request.get('run_id')
+        page = int(self.request.get('page'))
+        query = User.query().order(User.key)
+        user_keys, next_cursor = fetch_page(query, self.PAGE_SIZE,
+                                            self.request.get('cursor') or None,
+                                            keys_only=True)
+        if user_keys:
+            _add_named_task('reminders-{}-send-{}'.format(run_id, page),
+                            '/tasks/reminders/send',
+                            {'run_id': run_id,
+                             'user_key': [key.urlsafe() for key in user_keys]})
+        if next_cursor:
+            _add_named_task('reminders-{}-page-{}'.format(run_id, page + 1),
+                            '/tasks/reminders/fan_out',
+                            {'run_id': run_id, 'page': page + 1,
+                             'cursor': next_cursor})
+
+
+@instrument_handler
+class SendReminders(webapp2.RequestHandler):
+    def post(self):
+        """Send one reminder digest to each User of the batch who has any
+        active games. A failed send fails the task, so the queue retries it
+        with backoff; markers keep Users already mailed in this run from
+        getting a second digest."""
+        from google.appengine.api import app_identity, memcache
+        run_id = self.request.get('run_id')
+        user_keys = [ndb.Key(urlsafe=urlsafe)
+                     for urlsafe in self.request.get_all('user_key')]
+        # one keys-only query per User, all in flight at once
+        game_futures = [Game.query(Game.user == key, Game.game_over == False)
+                        .fetch_async(keys_only=True) for key in user_keys]
+        users = ndb.get_multi(user_keys)
         app_id = app_identity.get_application_id()
-        users = User.query(User.email != None)
-        for user in users:
-            active_games = Game.query(Game.user==user.key, Game.game_over==False,
-                                      Game.cancelled==False).order(Game.created)
-            for game in active_games:
-                subject = 'This is a reminder!'
-                body = """Hello {}, you have an uncompleted Hangman game!
-                
-                Game: {}
-                Created: {}
-                
-                """.format(user.name, game.key.urlsafe(), game.created)
-                # This will send test emails, the arguments to send_mail are:
-                # from, to, subject, body
-                mail.send_mail('noreply@{}.appspotmail.com'.format(app_id),
-                               user.email,
-                               subject,
-                               body)
+        for user, game_future in zip(users, game_futures):
+            game_keys = game_future.get_result()
+            if not user or not user.email or not game_keys:
+                continue
+            marker = MEMCACHE_REMINDER_SENT.format(run_id, user.key.id())
+            if not memcache.add(marker, True, time=REMINDER_MARKER_TTL):
+                continue
+            try:
+                self._send_digest(app_id, user, game_keys)
+            except Exception:
+                memcache.delete(marker)
+                raise
+
+    def _send_digest(self, app_id, user, game_keys):
+        from google.appengine.api import mail
+        subject = 'This is a reminder!'
+        games = '\n'.join('Game: {}'.format(key.urlsafe()) for key in game_keys)
+        body = """Hello {}, you have {} uncompleted Hangman game(s)!
+
+{}
+""".format(user.name, len(game_keys), games)
+        # This will send test emails, the arguments to send_mail are:
+        # from, to, subject, body
+        mail.send_mail('noreply@{}.appspotmail.com'.format(app_id),
+                       user.email,
+                       subject,
+                       body)
+
+
+@instrument_handler
+class FoldRecordShards(webapp2.RequestHandler):
+    def get(self):
+        """Fold the counter shards of hot UserRecords back into the records.
+        Called every 5 minutes using a cron job"""
+        for user_record in UserRecord.query(UserRecord.shards > 0):
+            user_record = user_record.fold_shards()
+            leaderboard.record_user(user_record, user_record.user.get())
+
+
+@instrument_handler
+class CompactScoreRollups(webapp2.RequestHandler):
+    def get(self):
+        """Fold the daily high score rollups of past weeks into weekly
+        rollups. Called every day using a cron job"""
+        weeks = leaderboard.compact_rollups(date.today())
+        logging.info('Compacted score rollups of %d weeks', weeks)
+
+
+@instrument_handler
+class MergeLeaderboards(webapp2.RequestHandler):
+    def get(self):
+        """Merge the results of ended games into the leaderboards. Scheduled
+        by end_game, and called every minute using a cron job to pick up
+        results whose merge task could not be added."""
+        merged = leaderboard.merge_pending()
+        if merged:
+            logging.info('Merged %d results into the leaderboards', merged)
+
+    def post(self):
+        self.get()
+
+
+def _archive_games(games, cutoff):
+    """Moves completed Games into ArchivedGames. The archives are written
+    before the Games are deleted, so a retried batch just rewrites them."""
+    ndb.put_multi([ArchivedGame.from_game(game) for game in games])
+    ndb.delete_multi([game.key for game in games])
+    return len(games)
+
+
+def _expire_games(games, cutoff):
+    """Ends the Games without a move since cutoff as losses, updating
+    Scores, UserRecords and leaderboards like any other game ending.
+    end_game skips Games already ended, so retries are safe."""
+    expired = 0
+    for game in games:
+        if movecache.enabled():
+            # moves buffered in memcache count as activity
+            game = movecache.get(game.key)
+        if not game or game.game_over or \
+                (game.last_move or game.created) >= cutoff:
+            continue
+        movecache.evict(game.key)
+        if game.end_game(False):
+            push.publish([game])
+            expired += 1
+    return expired
+
+
+@instrument_handler
+class ArchiveGames(webapp2.RequestHandler):
+    BATCH_SIZE = 100
+    # stage -> (game_over of the Games it pages through, age setting, step)
+    STAGES = {
+        'archive': (True, 'archive_after_days', _archive_games),
+        'expire': (False, 'abandon_after_days', _expire_games),
+    }
+
+    def get(self):
+        """Start a run archiving old completed Games and ending abandoned
+        ones. Called every day using a cron job"""
+        run_id = datetime.utcnow().strftime('%Y%m%d')
+        for stage in self.STAGES:
+            _add_named_task('{}-{}-batch-0'.format(stage, run_id),
+                            '/tasks/archive_games',
+                            {'run_id': run_id, 'stage': stage, 'batch': 0},
+                            MAINTENANCE_QUEUE)
+
+    def post(self):
+        """Process one batch of a stage, then enqueue a task for the next
+        batch. The cutoff derives from the run id, so a retried task sees
+        the same Games; each step skips work already done."""
+        run_id = self.request.get('run_id')
+        stage = self.request.get('stage')
+        batch = int(self.request.get('batch'))
+        game_over, setting, step = self.STAGES[stage]
+        cutoff = datetime.strptime(run_id, '%Y%m%d') - \
+            timedelta(days=Hangman.DEFAULTS[setting])
+        query = Game.query(Game.game_over == game_over, Game.created < cutoff)
+        games, next_cursor = fetch_page(query, self.BATCH_SIZE,
+                                        self.request.get('cursor') or None)
+        done = step(games, cutoff)
+        logging.info('%s run %s batch %d: %d of %d Games', stage, run_id,
+                     batch, done, len(games))
+        if next_cursor:
+            _add_named_task('{}-{}-batch-{}'.format(stage, run_id, batch + 1),
+                            '/tasks/archive_games',
+                            {'run_id': run_id, 'stage': stage,
+                             'batch': batch + 1, 'cursor': next_cursor},
+                            MAINTENANCE_QUEUE)
+
+
+@ndb.transactional
+def _pack_game_history(game_key):
+    game = game_key.get()
+    if game and game.pack_history():
+        game.put()
+
+
+@instrument_handler
+class PackGameHistory(webapp2.RequestHandler):
+    BATCH_SIZE = 100
+
+    def get(self):
+        """Start converting legacy JSON game histories to packed moves."""
+        taskqueue.add(url='/tasks/pack_history')
+
+    def post(self):
+        """Convert one batch of Games, then enqueue a task for the next
+        batch. Games already converted are skipped, so retries are safe."""
+        games, next_cursor = fetch_page(Game.query(), self.BATCH_SIZE,
+                                        self.request.get('cursor') or None)
+        converted = [game.key for game in games if game.history]
+        for game_key in converted:
+            _pack_game_history(game_key)
+        logging.info('Packed history of %d games', len(converted))
+        if next_cursor:
+            taskqueue.add(url='/tasks/pack_history',
+                          params={'cursor': next_cursor})
+
+
+def _migrate_user(user):
+    """Re-keys a User created before Users were keyed by normalized name,
+    moving its UserRecord and repointing its Games and Scores. Each step is
+    idempotent, so a retried or interrupted migration simply resumes."""
+    new_key = User.key_for(user.name)
+    existing = new_key.get()
+    if existing and existing.name != user.name:
+        logging.error('Cannot migrate User %s, name taken by %s',
+                      user.key.id(), existing.name)
+        return False
+    if not existing:
+        User(key=new_key, name=user.name, email=user.email).put()
+
+    for model in (Game, Score):
+        query = model.query(model.user == user.key)
+        cursor = None
+        while True:
+            batch, cursor = fetch_page(query, 100, cursor)
+            for entity in batch:
+                entity.user = new_key
+                if model is Game:
+                    movecache.evict(entity.key)
+            ndb.put_multi(batch)
+            if not cursor:
+                break
+
+    legacy_record = (UserRecord.key_for(user.key).get() or
+                     UserRecord.query(UserRecord.user == user.key).get())
+    if legacy_record:
+        legacy_record = legacy_record.fold_shards()
+        values = legacy_record.to_dict()
+        values.update(user=new_key, shards=0)
+        UserRecord(key=UserRecord.key_for(new_key), **values).put()
+        legacy_record.key.delete()
+    user.key.delete()
+    return True
+
+
+@instrument_handler
+class MigrateUsers(webapp2.RequestHandler):
+    BATCH_SIZE = 20
+
+    def get(self):
+        """Start re-keying Users by normalized user name."""
+        taskqueue.add(url='/tasks/migrate_users')
+
+    def post(self):
+        """Migrate one batch of legacy Users, then enqueue a task for the
+        next batch. The leaderboards are rebuilt once the run completes."""
+        users, next_cursor = fetch_page(User.query(), self.BATCH_SIZE,
+                                        self.request.get('cursor') or None)
+        legacy = [user for user in users
+                  if not isinstance(user.key.id(), basestring)]
+        migrated = sum(1 for user in legacy if _migrate_user(user))
+        logging.info('Migrated %d of %d legacy Users', migrated, len(legacy))
+        if next_cursor:
+            taskqueue.add(url='/tasks/migrate_users',
+                          params={'cursor': next_cursor})
+        else:
+            ndb.delete_multi([ndb.Key(leaderboard.Leaderboard, board) for
+                              board in (leaderboard.SCORES,
+                                        leaderboard.RANKINGS)])
+            leaderboard.invalidate(leaderboard.SCORES)
+            leaderboard.invalidate(leaderboard.RANKINGS)
+
+
+@instrument_handler
+class IndexUserNames(webapp2.RequestHandler):
+    BATCH_SIZE = 100
+
+    def get(self):
+        """Start writing name_key on Users created before they were keyed
+        by name, so the legacy lookup finds them by normalized name."""
+        taskqueue.add(url='/tasks/index_user_names')
+
+    def post(self):
+        """Rewrite one batch of legacy Users, then enqueue a task for the
+        next batch. Rewriting is idempotent, so retries are safe."""
+        users, next_cursor = fetch_page(User.query(), self.BATCH_SIZE,
+                                        self.request.get('cursor') or None)
+        legacy = [user for user in users
+                  if not isinstance(user.key.id(), basestring)]
+        ndb.put_multi(legacy)
+        logging.info('Indexed the names of %d legacy Users', len(legacy))
+        if next_cursor:
+            taskqueue.add(url='/tasks/index_user_names',
+                          params={'cursor': next_cursor})
+
+
+class WarmUp(webapp2.RequestHandler):
+    def get(self):
+        """Load what the first API requests need before the instance gets
+        traffic: the Endpoints stack with the API, the dictionary index
+        and the solver's NumPy."""
+        import api
+        import solver
+        import words
+        words.get_index()
+        # one opening hint runs the NumPy filter and caches its result
+        solver.solve('_' * 7, '')
+        logging.info('Warmed up %s', api.api)
+
+
+class AdminStats(webapp2.RequestHandler):
+    def get(self):
+        """Return the per-endpoint figures aggregated on this instance."""
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.write(json.dumps({
+            'profile_rate': instrumentation.get_profile_rate(),
+            'in_flight': instrumentation.in_flight(),
+            'endpoints': instrumentation.snapshot(),
+        }, indent=2, sort_keys=True))
+
+    def post(self):
+        """Set the cProfile sampling rate (profile_rate, 0 to 1) for every
+        instance and/or clear this instance's figures (reset=1)."""
+        rate = self.request.get('profile_rate')
+        if rate:
+            try:
+                rate = float(rate)
+            except ValueError:
+                rate = -1
+            if not 0 <= rate <= 1:
+                self.abort(400, detail='profile_rate must be between 0 and 1')
+            instrumentation.set_profile_rate(rate)
+        if self.request.get('reset'):
+            instrumentation.reset()
+        self.get()
 
 
 app = webapp2.WSGIApplication([
     ('/crons/send_reminder', SendReminderEmail),
+    ('/tasks/reminders/fan_out', FanOutReminders),
+    ('/tasks/reminders/send', SendReminders),
+    ('/crons/fold_record_shards', FoldRecordShards),
+    ('/crons/compact_score_rollups', CompactScoreRollups),
+    ('/crons/merge_leaderboards', MergeLeaderboards),
+    ('/tasks/merge_leaderboards', MergeLeaderboards),
+    ('/crons/archive_games', ArchiveGames),
+    ('/tasks/archive_games', ArchiveGames),
+    ('/tasks/pack_history', PackGameHistory),
+    ('/tasks/migrate_users', MigrateUsers),
+    ('/tasks/index_user_names', IndexUserNames),
+    ('/admin/stats', AdminStats),
+    ('/_ah/warmup', WarmUp),
 ], debug=True)
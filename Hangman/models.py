@@ -1,16 +1,47 @@
 """models.py - This file contains the class definitions for the Datastore
 entities used by the Game. Because these classes are also regular Python
-classes they can include methods (such as 'to_form' and 'new_game')."""
+classes they can include methods (such as 'to_form' and 'new_game'). The
+forms those methods build are imported from forms.py inside the methods,
+so loading the entities alone doesn't pull in protorpc."""
 
+import json
 import random
-from datetime import date
-from protorpc import messages
+import string
+from datetime import date, datetime
 from google.appengine.ext import ndb
+from utils import get_multi_map
 
 class Hangman:
     DEFAULTS = {
         'guess_limit': 6,
         'points_per_hit': 2,
+        # keep games in progress in memcache, writing them to the datastore
+        # every 'flush_every' moves, on game end and on cancel
+        'write_behind': False,
+        'flush_every': 5,
+        # fall back to querying User by name for Users not yet re-keyed by
+        # /tasks/migrate_users; turn off once the migration has run
+        'legacy_user_lookup': True,
+        # the archive_games cron moves completed games older than this into
+        # ArchivedGame, and ends active games left untouched for as long as
+        # 'abandon_after_days' as losses
+        'archive_after_days': 30,
+        'abandon_after_days': 14,
+        # transport pushing game state to subscribers: 'channel' (Channel
+        # API), 'local' (in-process, for the dev server) or None to disable
+        'push_transport': 'channel',
+        # token buckets per endpoint and scope ('game', 'user' name or
+        # 'client' address): (tokens per second, burst)
+        'rate_limits': {
+            'make_move': {'game': (2, 10), 'client': (10, 40)},
+            'batch_make_move': {'client': (10, 100)},
+            'create_user': {'user': (0.1, 3), 'client': (0.5, 10)},
+            'new_game': {'user': (1, 10), 'client': (2, 20)},
+            'batch_new_game': {'client': (2, 100)},
+        },
+        # reject expensive listings while more requests than this are in
+        # flight on an instance, 0 to never shed load
+        'shed_load_in_flight': 8,
         'images': {
             'start': '//upload.wikimedia.org/wikipedia/commons/thumb'\
                    '/8/8b/Hangman-0.png/60px-Hangman-0.png' ,
@@ -31,9 +62,96 @@ class Hangman:
 
 
 class User(ndb.Model):
-    """User profile"""
+    """User profile, keyed by the normalized user name"""
     name = ndb.StringProperty(required=True)
     email = ndb.StringProperty()
+    # lets Users created before they were keyed by name be found by the
+    # normalized name; written for old entities by /tasks/index_user_names
+    name_key = ndb.ComputedProperty(lambda self: User.normalize(self.name))
+
+    @staticmethod
+    def normalize(name):
+        return (name or '').strip().lower()
+
+    @classmethod
+    def key_for(cls, name):
+        return ndb.Key(cls, cls.normalize(name))
+
+    @classmethod
+    def get_by_name(cls, name):
+        """Returns the User with a name, or None. Users created before they
+        were keyed by name are found by query until they are migrated."""
+        if not cls.normalize(name):
+            return None
+        user = cls.key_for(name).get()
+        if user is None and Hangman.DEFAULTS['legacy_user_lookup']:
+            user = cls._get_legacy(name)
+        return user
+
+    @classmethod
+    def _get_legacy(cls, name):
+        return cls._get_legacy_async(name).get_result()
+
+    @classmethod
+    @ndb.tasklet
+    def _get_legacy_async(cls, name):
+        """Tasklet returning a User whose name normalizes like name by
+        query, or None. Called when the key lookup missed, so a User found
+        is a legacy one. Legacy Users whose name_key was not written yet
+        are only found by their exact name."""
+        user = yield cls.query(cls.name_key == cls.normalize(name)).get_async()
+        if user is None:
+            user = yield cls.query(cls.name == name).get_async()
+        raise ndb.Return(user)
+
+    @classmethod
+    def get_multi_by_name(cls, names):
+        """Returns a dict of name -> User (or None) resolved with one batched
+        get. The legacy queries for names it misses all run concurrently."""
+        names = list(set(names))
+        valid = [name for name in names if cls.normalize(name)]
+        users = ndb.get_multi([cls.key_for(name) for name in valid])
+        found = dict.fromkeys(names)
+        found.update(zip(valid, users))
+        if Hangman.DEFAULTS['legacy_user_lookup']:
+            missing = [name for name in valid if found[name] is None]
+            futures = [cls._get_legacy_async(name) for name in missing]
+            for name, future in zip(missing, futures):
+                found[name] = future.get_result()
+        return found
+
+    @classmethod
+    def create(cls, name, email=None):
+        """Creates a User with its UserRecord. Returns None if the name is
+        taken, including by a legacy User that will migrate to the same key."""
+        if Hangman.DEFAULTS['legacy_user_lookup'] and cls._get_legacy(name):
+            return None
+        return cls._create(name, email)
+
+    @classmethod
+    @ndb.transactional(xg=True)
+    def _create(cls, name, email):
+        key = cls.key_for(name)
+        if key.get():
+            return None
+        user = cls(key=key, name=name, email=email)
+        user_record = UserRecord(key=UserRecord.key_for(key), user=key)
+        ndb.put_multi([user, user_record])
+        return user
+
+
+def letter_bit(letter):
+    """Returns the bit of an upper case letter A-Z in a 26-bit letter mask"""
+    return 1 << (ord(letter) - ord('A'))
+
+
+def letter_mask(letters):
+    """Returns the 26-bit mask of a collection of upper case letters"""
+    mask = 0
+    for letter in letters:
+        if letter in string.ascii_uppercase:
+            mask |= letter_bit(letter)
+    return mask
 
 
 class UserRecord(ndb.Model):
@@ -43,18 +161,116 @@ class UserRecord(ndb.Model):
     wins = ndb.IntegerProperty(required=True, default=0)
     losses = ndb.IntegerProperty(required=True, default=0)
     win_pct = ndb.FloatProperty(required=True, default=0.00)
+    # number of UserRecordShards taking this user's results, 0 = unsharded
+    shards = ndb.IntegerProperty(default=0)
+
+    @classmethod
+    def key_for(cls, user_key):
+        """Returns the UserRecord key of a User, which shares its id"""
+        return ndb.Key(cls, user_key.id())
+
+    @classmethod
+    def create(cls, user_key):
+        """Creates and returns the UserRecord of a new User"""
+        user_record = cls(key=cls.key_for(user_key), user=user_key)
+        user_record.put()
+        return user_record
+
+    @classmethod
+    def get_for_user(cls, user_key):
+        """Returns the UserRecord of a User. Records created before they were
+        keyed by User are looked up by query once and re-keyed."""
+        user_record = cls.key_for(user_key).get()
+        if user_record:
+            return user_record
+        legacy = cls.query(cls.user == user_key).get()
+        if not legacy:
+            return cls.create(user_key)
+        user_record = cls(key=cls.key_for(user_key),
+                          **legacy.to_dict())
+        user_record.put()
+        legacy.key.delete()
+        return user_record
+
+    def add_result(self, won):
+        """Counts a finished game"""
+        if won:
+            self.wins += 1
+        else:
+            self.losses += 1
+        self.games += 1
+        self.win_pct = round(float(self.wins) / self.games, 3)
+
+    def shard_keys(self):
+        return [UserRecordShard.key_for(self.key, index)
+                for index in range(self.shards)]
+
+    @ndb.transactional(xg=True)
+    def _fold_shard(self, shard_key):
+        user_record, shard = ndb.get_multi([self.key, shard_key])
+        if not shard or not shard.games:
+            return user_record
+        user_record.wins += shard.wins
+        user_record.losses += shard.losses
+        user_record.games += shard.games
+        user_record.win_pct = round(
+                float(user_record.wins) / user_record.games, 3)
+        shard.wins = shard.losses = shard.games = 0
+        ndb.put_multi([user_record, shard])
+        return user_record
+
+    def fold_shards(self):
+        """Moves the results collected by this record's shards into the
+        record itself and returns the updated record"""
+        user_record = self
+        for shard_key in self.shard_keys():
+            user_record = self._fold_shard(shard_key)
+        return user_record
 
     def to_form(self):
-        return UserRecordForm(user_name=self.user.get().name,
+        return UserRecord.to_forms([self])[0]
+
+    @classmethod
+    def to_forms(cls, records):
+        """Returns UserRecordForms for a page of UserRecords, resolving every
+        referenced User with one batched get"""
+        users = get_multi_map(record.user for record in records)
+        return [record._to_form(users[record.user]) for record in records]
+
+    def _to_form(self, user):
+        from forms import UserRecordForm
+        return UserRecordForm(user_name=user.name,
                          games=self.games,
                          wins=self.wins,
                          losses=self.losses,
                          win_pct="{0:.3f}".format(self.win_pct))
 
 
+class UserRecordShard(ndb.Model):
+    """Counter shard of a hot UserRecord. Each shard is its own entity group,
+    so concurrent game endings for the same user don't contend; the cron
+    job folds shards back into the UserRecord."""
+    games = ndb.IntegerProperty(default=0)
+    wins = ndb.IntegerProperty(default=0)
+    losses = ndb.IntegerProperty(default=0)
+
+    @classmethod
+    def key_for(cls, record_key, index):
+        return ndb.Key(cls, '{0}-{1}'.format(record_key.id(), index))
+
+    def add_result(self, won):
+        if won:
+            self.wins += 1
+        else:
+            self.losses += 1
+        self.games += 1
+
+
 class Game(ndb.Model):
     """Game object"""
     created = ndb.DateTimeProperty(auto_now_add=True)
+    # time of the latest move; kept with the live state in the movecache
+    last_move = ndb.DateTimeProperty(indexed=False)
     word = ndb.StringProperty(required=True)
     miss_count = ndb.IntegerProperty(default=0)
     match_count = ndb.IntegerProperty(default=0)
@@ -64,26 +280,117 @@ class Game(ndb.Model):
     image_uri = ndb.StringProperty(default=Hangman.DEFAULTS['images']['start'])
     game_over = ndb.BooleanProperty(required=True, default=False)
     user = ndb.KeyProperty(required=True, kind='User')
-    history = ndb.StringProperty(repeated=True)
+    # legacy move history, one JSON string per move - see 'moves'
+    history = ndb.StringProperty(repeated=True, indexed=False)
+    # packed move history: the guessed letters in order. Whether a move hit
+    # follows from 'word', so one character per move is enough.
+    moves = ndb.StringProperty(indexed=False, default='')
     game_won = ndb.BooleanProperty(default=False)
+    # letter index of 'word': letter -> positions, plus 26-bit masks of the
+    # letters to find, the letters guessed and the letters hit
+    letter_positions = ndb.JsonProperty()
+    word_mask = ndb.IntegerProperty(indexed=False)
+    guessed_mask = ndb.IntegerProperty(indexed=False, default=0)
+    hit_mask = ndb.IntegerProperty(indexed=False, default=0)
 
     @classmethod
     def new_game(cls, user, word):
         """Creates and returns a new game"""
+        game = cls.build(user, word)
+        game.put()
+        return game
+
+    @classmethod
+    def build(cls, user, word):
+        """Returns a new, unsaved game"""
         word_upper = word.upper()
         game = Game(user=user,
                     word=word_upper,
                     game_over=False)
-        game.put()
+        game.index_word()
         return game
 
+    def index_word(self):
+        """Builds the letter index of the word. Characters other than A-Z
+        are shown from the start and never need guessing."""
+        positions = {}
+        for position, char in enumerate(self.word):
+            if char in string.ascii_uppercase:
+                positions.setdefault(char, []).append(position)
+        self.letter_positions = positions
+        self.word_mask = letter_mask(positions)
+        # games created before the index existed carry only hits/misses
+        self.guessed_mask = letter_mask(self.hits + self.misses)
+        self.hit_mask = letter_mask(self.hits) & self.word_mask
+
+    def _ensure_index(self):
+        if self.word_mask is None:
+            self.index_word()
+
+    def is_guessed(self, letter):
+        """True if the letter was guessed before"""
+        self._ensure_index()
+        return bool(self.guessed_mask & letter_bit(letter))
+
+    def guess(self, letter):
+        """Applies a new guess of an upper case letter. Returns True on a
+        hit."""
+        self._ensure_index()
+        bit = letter_bit(letter)
+        self.guessed_mask |= bit
+        positions = self.letter_positions.get(letter)
+        if positions:
+            self.hit_mask |= bit
+            self.hits.append(letter)
+            self.match_count += len(positions)
+            return True
+        self.misses.append(letter)
+        miss_count = self.miss_count
+        self.miss_count = miss_count + 1
+        if miss_count < self.guess_limit:
+            img_key = "guess-{0}".format(self.miss_count)
+            self.image_uri = Hangman.DEFAULTS['images'][img_key]
+        return False
+
+    def is_won(self):
+        self._ensure_index()
+        return self.hit_mask == self.word_mask
+
+    def is_lost(self):
+        return self.miss_count >= self.guess_limit
+
+    def pattern(self):
+        """Returns the word with letters not yet hit blanked, e.g.
+        'H_NG_AN'"""
+        self._ensure_index()
+        return ''.join(
+            '_' if char in string.ascii_uppercase and
+                   not self.hit_mask & letter_bit(char) else char
+            for char in self.word)
+
+    def masked_word(self):
+        """Returns the pattern spaced out for display, e.g. 'H _ N G _ A N'"""
+        return ' '.join(self.pattern())
+
     def to_form(self, message):
         """Returns a GameForm representation of the Game"""
+        return self.to_form_async(message).get_result()
+
+    @ndb.tasklet
+    def to_form_async(self, message):
+        """Tasklet returning a GameForm representation of the Game"""
+        user = yield self.user.get_async()
+        raise ndb.Return(self._to_form(user, message))
+
+    def _to_form(self, user, message):
+        from forms import GameForm
         form = GameForm()
         form.created = str(self.created)
         form.urlsafe_key = self.key.urlsafe()
-        form.user_name = self.user.get().name
-        form.word = self.word
+        form.user_name = user.name
+        if self.game_over:
+            form.word = self.word
+        form.masked_word = self.masked_word()
         form.miss_count = self.miss_count
         form.match_count = self.match_count
         form.guess_limit = self.guess_limit
@@ -95,21 +402,64 @@ class Game(ndb.Model):
         form.game_won = self.game_won
         return form
 
+    def to_summary_form(self, user_name):
+        """Returns a GameSummaryForm. Works on entities loaded with
+        Game.SUMMARY_PROJECTION."""
+        from forms import GameSummaryForm
+        return GameSummaryForm(urlsafe_key=self.key.urlsafe(),
+                               user_name=user_name,
+                               created=str(self.created),
+                               word_length=len(self.word),
+                               miss_count=self.miss_count,
+                               match_count=self.match_count,
+                               guess_limit=self.guess_limit)
+
+    def record_move(self, guess):
+        """Appends a guess to the packed move history"""
+        self.pack_history()
+        self.moves += guess
+        self.last_move = datetime.utcnow()
+
+    def move_count(self):
+        return len(self.history) + len(self.moves)
+
+    def pack_history(self):
+        """Converts a legacy JSON history into the packed 'moves' string.
+        Returns True if there was anything to convert."""
+        if not self.history:
+            return False
+        legacy = ''.join(json.loads(move)['Guess'] for move in self.history)
+        self.moves = legacy + self.moves
+        self.history = []
+        return True
+
+    def iter_history(self):
+        """Lazily decodes the move history into (guess, result) pairs"""
+        for move in self.history:
+            move = json.loads(move)
+            yield move['Guess'], move['Result']
+        for guess in self.moves:
+            yield guess, 'Hit!' if guess in self.word else 'Miss!'
+
     def to_history_form(self):
         """Returns a GameHistoryForm"""
+        from forms import GameHistoryForm
         form = GameHistoryForm()
-        form.word = self.word
-        form.history = self.history
+        if self.game_over:
+            form.word = self.word
+        form.history = [json.dumps({'Guess': guess, 'Result': result})
+                        for guess, result in self.iter_history()]
         form.game_over = self.game_over
         form.game_won = self.game_won
         return form
 
     def end_game(self, won=False):
         """Ends the game - if won is True, the player won. - if won is False,
-        the player lost."""
+        the player lost. The Game, its Score and the UserRecord are written
+        in a single transaction. Returns False if the game had already been
+        ended elsewhere."""
         self.game_over = True
         self.game_won = won
-        self.put()
 
         # add the game to the score 'board'
         final_score = 0
@@ -117,17 +467,35 @@ class Game(ndb.Model):
             final_score = len(self.hits) * Hangman.DEFAULTS['points_per_hit']
         score = Score(user=self.user, date=date.today(),
                         game=self.key, won=won, score=final_score)
-        score.put()
 
-        # udate the UserRecord
-        user_record = UserRecord.query(UserRecord.user == self.user).get()
-        if won:
-            user_record.wins += 1
+        user_record = UserRecord.get_for_user(self.user)
+        if not self._commit_end(score, user_record.shards):
+            return False
+
+        # the materialized leaderboards are merged in batches, off the request
+        import leaderboard
+        leaderboard.schedule_merge()
+        return True
+
+    @ndb.transactional(xg=True)
+    def _commit_end(self, score, shards):
+        stored = self.key.get()
+        if stored and stored.game_over:
+            return False
+        record_key = UserRecord.key_for(self.user)
+        if shards:
+            # spread a hot user's results over counter shards
+            counter_key = UserRecordShard.key_for(record_key,
+                                                  random.randrange(shards))
+            counter = counter_key.get() or UserRecordShard(key=counter_key)
         else:
-            user_record.losses += 1
-        user_record.games += 1
-        user_record.win_pct = round(user_record.wins / user_record.games, 3)
-        user_record.put()
+            counter = record_key.get()
+        counter.add_result(self.game_won)
+        ndb.put_multi([self, score, counter])
+        import leaderboard
+        # a sharded record reaches the rankings when the cron folds it
+        leaderboard.queue_result(score.key, merge_user=not shards)
+        return True
 
 
 class Score(ndb.Model):
@@ -139,92 +507,86 @@ class Score(ndb.Model):
     score = ndb.IntegerProperty(required=True, default=0)
 
     def to_form(self):
-        return ScoreForm(user_name=self.user.get().name, won=self.won,
-                         date=str(self.date),
-                         guess_limit=self.game.get().guess_limit,
-                         miss_count=len(self.game.get().misses),
-                         word_count=len(self.game.get().word),
-                         score=self.score, word=self.game.get().word)
-
-
-class GameForm(messages.Message):
-    """GameForm for outbound game state information"""
-    urlsafe_key = messages.StringField(1, required=True)
-    word = messages.StringField(2, required=True)
-    miss_count = messages.IntegerField(3)
-    game_over = messages.BooleanField(4, required=True)
-    message = messages.StringField(5, required=True)
-    user_name = messages.StringField(6, required=True)
-    created = messages.StringField(7, required=True)
-    guesses = messages.IntegerField(8)
-    hits = messages.StringField(9, repeated=True)
-    misses = messages.StringField(10, repeated=True)
-    image_uri = messages.StringField(11)
-    guess_limit = messages.IntegerField(12)
-    match_count = messages.IntegerField(13)
-    game_won = messages.BooleanField(14)
-
-
-class GameForms(messages.Message):
-    """Return multiple GameForms"""
-    items = messages.MessageField(GameForm, 1, repeated=True)
-
-
-class GameHistoryForm(messages.Message):
-    """GameHistoryForm for outbound game state information"""
-    word = messages.StringField(1, required=True)
-    history = messages.StringField(2, repeated=True)
-    game_over = messages.BooleanField(3)
-    game_won = messages.BooleanField(4)
+        return Score.to_forms([self])[0]
 
+    @classmethod
+    def to_summary_forms(cls, scores):
+        """Returns ScoreSummaryForms for a page of Scores. Only the users are
+        fetched, so entities loaded with Score.SUMMARY_PROJECTION suffice."""
+        from forms import ScoreSummaryForm
+        users = get_multi_map(score.user for score in scores)
+        return [ScoreSummaryForm(user_name=users[score.user].name,
+                                 date=str(score.date), won=score.won,
+                                 score=score.score)
+                for score in scores]
 
-class CancelGameForm(messages.Message):
-    success = messages.BooleanField(1, required=True)
-    message = messages.StringField(2, required=True)
-
-
-class NewGameForm(messages.Message):
-    """Used to create a new game"""
-    user_name = messages.StringField(1, required=True)
-    word = messages.StringField(2, required=True)
-
-
-class MakeMoveForm(messages.Message):
-    """Used to make a move in an existing game"""
-    guess = messages.StringField(1, required=True)
-
-
-class ScoreForm(messages.Message):
-    """ScoreForm for outbound Score information"""
-    user_name = messages.StringField(1, required=True)
-    date = messages.StringField(2, required=True)
-    won = messages.BooleanField(3, required=True)
-    guess_limit = messages.IntegerField(4, required=True)
-    miss_count = messages.IntegerField(5, required=True)
-    word_count = messages.IntegerField(6, required=True)
-    score = messages.IntegerField(7, required=True)
-    word = messages.StringField(8, required=True)
-
-
-class ScoreForms(messages.Message):
-    """Return multiple ScoreForms"""
-    items = messages.MessageField(ScoreForm, 1, repeated=True)
-
-
-class UserRecordForm(messages.Message):
-    """UserRecordForm for outbound UserRecord information"""
-    user_name = messages.StringField(1, required=True)
-    games = messages.IntegerField(2, required=True)
-    wins = messages.IntegerField(3, required=True)
-    losses = messages.IntegerField(4, required=True)
-    win_pct = messages.StringField(5, required=True)
-
+    @classmethod
+    def to_forms(cls, scores):
+        """Returns ScoreForms for a page of Scores, resolving every referenced
+        User and Game with one batched get. Games since archived are read
+        from ArchivedGame in a second one."""
+        keys = [score.user for score in scores] + [score.game for score in scores]
+        entities = get_multi_map(keys)
+        archived = [score.game for score in scores if not entities[score.game]]
+        if archived:
+            entities.update(get_multi_map(ArchivedGame.key_for(key)
+                                          for key in archived))
+            for key in archived:
+                entities[key] = entities[ArchivedGame.key_for(key)]
+        return [score._to_form(entities[score.user], entities[score.game])
+                for score in scores]
+
+    def _to_form(self, user, game):
+        from forms import ScoreForm
+        return ScoreForm(user_name=user.name, won=self.won,
+                         date=str(self.date),
+                         guess_limit=game.guess_limit,
+                         miss_count=len(game.misses),
+                         word_count=len(game.word),
+                         score=self.score, word=game.word)
+
+
+# Properties read by the summary listings. Projection queries serve them
+# straight from the composite indexes in index.yaml.
+Game.SUMMARY_PROJECTION = ('created', 'guess_limit', 'match_count',
+                           'miss_count', 'word')
+Score.SUMMARY_PROJECTION = ('date', 'score', 'user', 'won')
+
+
+class ArchivedGame(ndb.Model):
+    """Compact copy of a completed Game, keyed by the Game's id so Scores
+    keep resolving it. Nothing is indexed; hits and misses are packed into
+    strings like the moves."""
+    _default_indexed = False
+    user = ndb.KeyProperty(kind='User')
+    created = ndb.DateTimeProperty()
+    word = ndb.StringProperty()
+    guess_limit = ndb.IntegerProperty()
+    hits = ndb.StringProperty(default='')
+    misses = ndb.StringProperty(default='')
+    moves = ndb.StringProperty(default='')
+    game_won = ndb.BooleanProperty(default=False)
 
-class UserRecordForms(messages.Message):
-    """Return multiple UserRecordForms"""
-    items = messages.MessageField(UserRecordForm, 1, repeated=True)
+    @classmethod
+    def key_for(cls, game_key):
+        return ndb.Key(ArchivedGame, game_key.id())
 
+    @classmethod
+    def from_game(cls, game):
+        """Returns an unsaved ArchivedGame for a completed Game"""
+        game.pack_history()
+        return ArchivedGame(key=cls.key_for(game.key), user=game.user,
+                            created=game.created, word=game.word,
+                            guess_limit=game.guess_limit,
+                            hits=''.join(game.hits),
+                            misses=''.join(game.misses),
+                            moves=game.moves, game_won=game.game_won)
 
-class StringMessage(messages.Message):
-    """StringMessage-- outbound (single) string message"""
-    message = messages.StringField(1, required=True)
+    def to_history_form(self):
+        """Returns a GameHistoryForm"""
+        from forms import GameHistoryForm
+        history = [json.dumps({'Guess': guess,
+                               'Result': 'Hit!' if guess in self.word else 'Miss!'})
+                   for guess in self.moves]
+        return GameHistoryForm(word=self.word, history=history,
+                               game_over=True, game_won=self.game_won)
@@ -0,0 +1,85 @@
+"""movecache.py - Opt-in write-behind buffer for games in progress. When
+Hangman.DEFAULTS['write_behind'] is set, the live state of a game is kept in
+memcache, guarded by compare-and-set, and written to the datastore only every
+'flush_every' moves, when the game ends or when it is cancelled. A cache miss
+rebuilds the state from the datastore, so at most 'flush_every' - 1 moves can
+be lost if memcache evicts a game."""
+
+from google.appengine.api import memcache
+
+from models import Hangman
+
+MEMCACHE_GAME = 'GAME_{}'
+
+# Attempts at a compare-and-set before giving up on a move
+CAS_RETRIES = 10
+
+
+def enabled():
+    return Hangman.DEFAULTS['write_behind']
+
+
+def _cache_key(game_key):
+    return MEMCACHE_GAME.format(game_key.urlsafe())
+
+
+def get(game_key):
+    """Returns the live state of a Game, or None if it doesn't exist"""
+    game = memcache.get(_cache_key(game_key))
+    if game is None:
+        game = game_key.get()
+        if game and not game.game_over:
+            memcache.add(_cache_key(game_key), game)
+    return game
+
+
+def update(game_key, move):
+    """Applies move(game) to the live state of a Game.
+    Args:
+        game_key: The ndb.Key of the Game
+        move: Function mutating a Game in place and returning a result. It
+            may raise to reject the move, leaving the state untouched.
+    Returns:
+        A (game, result) tuple. game is None if the Game doesn't exist and
+        result is None if the game was already over. A game the move
+        decided is returned but not cached; the caller ends it.
+    Raises:
+        endpoints.ConflictException: If every compare-and-set attempt lost
+            against concurrent moves."""
+    client = memcache.Client()
+    key = _cache_key(game_key)
+    for _ in range(CAS_RETRIES):
+        game = client.gets(key)
+        if game is None:
+            game = game_key.get()
+            if not game or game.game_over:
+                return game, None
+            if not client.add(key, game) and client.gets(key) is None:
+                # memcache is unavailable, write the move through instead
+                result = move(game)
+                if not game.game_over:
+                    game.put()
+                return game, result
+            continue
+        if game.game_over:
+            return game, None
+        result = move(game)
+        if game.game_over:
+            # a deciding move is only stored by end_game, which evicts the
+            # game; if ending fails, the cache still holds the game in
+            # progress and the move can be played again
+            return game, result
+        if client.cas(key, game):
+            flush_every = Hangman.DEFAULTS['flush_every']
+            if not game.game_over and game.move_count() % flush_every == 0:
+                game.put()
+            return game, result
+    import endpoints
+    raise endpoints.ConflictException(
+            'Too many concurrent moves on this game, try again')
+
+
+def evict(game_key):
+    """Drops the live state of a Game that was ended or cancelled"""
+    if enabled():
+        memcache.delete(_cache_key(game_key))
@@ -0,0 +1,204 @@
+"""push.py - Pushes game state to subscribed clients (spectators, a second
+device) so they don't have to poll get_game. After a move, game ending or
+cancellation is written, a compact JSON state message is sent to every
+subscriber of the game. Each message carries the whole visible state, so a
+client that misses one catches up with the next.
+
+Subscribers are kept per game in memcache, for as long as their channel is
+open. Delivery goes through a pluggable transport chosen by
+Hangman.DEFAULTS['push_transport']: the App Engine Channel API ('channel')
+or an in-process queue ('local') for the dev server and benchmarks."""
+
+import collections
+import json
+import logging
+import threading
+import time
+import uuid
+
+from google.appengine.api import memcache
+
+from models import Hangman
+
+MEMCACHE_SUBSCRIBERS = 'SUBSCRIBERS_{}'
+
+# Channel API tokens stay valid for two hours at most
+SUBSCRIPTION_MINUTES = 120
+
+# Attempts at a compare-and-set before giving up on a subscription
+CAS_RETRIES = 10
+
+
+class ChannelTransport(object):
+    """Delivers messages over the App Engine Channel API"""
+
+    def open(self, client_id, duration_minutes):
+        """Returns the token the client connects with"""
+        from google.appengine.api import channel
+        return channel.create_channel(client_id,
+                                      duration_minutes=duration_minutes)
+
+    def send_async(self, client_id, message):
+        """Starts sending a message and returns the RPC. channel.send_message
+        only comes in a blocking form, so the call is made directly."""
+        from google.appengine.api import api_base_pb, apiproxy_stub_map
+        from google.appengine.api import channel
+        from google.appengine.api.channel import channel_service_pb
+        request = channel_service_pb.SendMessageRequest()
+        request.set_application_key(client_id)
+        request.set_message(message)
+        rpc = apiproxy_stub_map.UserRPC(channel._GetService())
+        rpc.make_call('SendChannelMessage', request, api_base_pb.VoidProto())
+        return rpc
+
+
+class _Sent(object):
+    """Stands in for the RPC of a message delivered on the spot"""
+
+    def check_success(self):
+        pass
+
+
+class LocalTransport(object):
+    """In-process stand-in for the Channel API. Messages are queued per
+    client and read back with receive."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._queues = collections.defaultdict(list)
+
+    def open(self, client_id, duration_minutes):
+        return client_id
+
+    def send_async(self, client_id, message):
+        with self._lock:
+            self._queues[client_id].append(message)
+        return _Sent()
+
+    def receive(self, client_id):
+        """Returns and forgets the messages queued for a client"""
+        with self._lock:
+            return self._queues.pop(client_id, [])
+
+
+TRANSPORTS = {
+    'channel': ChannelTransport,
+    'local': LocalTransport,
+}
+
+_transport = None
+
+
+def enabled():
+    return bool(Hangman.DEFAULTS['push_transport'])
+
+
+def get_transport():
+    global _transport
+    if _transport is None:
+        _transport = TRANSPORTS[Hangman.DEFAULTS['push_transport']]()
+    return _transport
+
+
+def set_transport(transport):
+    """Replaces the transport, e.g. with a LocalTransport"""
+    global _transport
+    _transport = transport
+
+
+def _cache_key(game_key):
+    return MEMCACHE_SUBSCRIBERS.format(game_key.urlsafe())
+
+
+def subscribe(game_key):
+    """Registers a new subscriber to a Game.
+    Returns:
+        A (client_id, token) tuple. The client opens the transport with
+        token; client_id identifies it to the transport.
+    Raises:
+        endpoints.ConflictException: If the subscription could not be
+            stored."""
+    client_id = '{}-{}'.format(game_key.id(), uuid.uuid4().hex)
+    token = get_transport().open(client_id, SUBSCRIPTION_MINUTES)
+    expires = time.time() + SUBSCRIPTION_MINUTES * 60
+    client = memcache.Client()
+    key = _cache_key(game_key)
+    for _ in range(CAS_RETRIES):
+        subscribers = client.gets(key)
+        if subscribers is None:
+            if client.add(key, {client_id: expires},
+                          time=SUBSCRIPTION_MINUTES * 60):
+                return client_id, token
+            continue
+        now = time.time()
+        subscribers = dict((subscriber, until) for subscriber, until
+                           in subscribers.items() if until > now)
+        subscribers[client_id] = expires
+        if client.cas(key, subscribers, time=SUBSCRIPTION_MINUTES * 60):
+            return client_id, token
+    import endpoints
+    raise endpoints.ConflictException(
+            'Could not subscribe to this game, try again')
+
+
+def game_state(game):
+    """Returns the state message of a Game. The word is only revealed once
+    the game is over."""
+    moves = ''.join(guess for guess, _ in game.iter_history())
+    state = {
+        'game': game.key.urlsafe(),
+        'seq': len(moves),
+        'moves': moves,
+        'masked_word': game.masked_word(),
+        'miss_count': game.miss_count,
+        'match_count': game.match_count,
+        'guess_limit': game.guess_limit,
+        'image_uri': game.image_uri,
+        'game_over': game.game_over,
+        'game_won': game.game_won,
+    }
+    if game.game_over:
+        state['word'] = game.word
+    return state
+
+
+def _send(messages):
+    """Sends (game_key, message) pairs to the current subscribers of each
+    game, reading all subscriber lists with one memcache call. All sends
+    are started before any is waited on. Delivery is best effort: the state
+    is already stored, so a failed send is only logged."""
+    if not enabled():
+        return
+    messages = dict((_cache_key(game_key), message)
+                    for game_key, message in messages)
+    if not messages:
+        return
+    transport = get_transport()
+    now = time.time()
+    rpcs = []
+    for key, subscribers in memcache.get_multi(messages.keys()).items():
+        for client_id, expires in subscribers.items():
+            if expires <= now:
+                continue
+            try:
+                rpcs.append((client_id,
+                             transport.send_async(client_id, messages[key])))
+            except Exception:
+                logging.warning('Push to %s failed', client_id, exc_info=True)
+    for client_id, rpc in rpcs:
+        try:
+            rpc.check_success()
+        except Exception:
+            logging.warning('Push to %s failed', client_id, exc_info=True)
+
+
+def publish(games):
+    """Sends the current state of each Game to its subscribers"""
+    _send((game.key, json.dumps(game_state(game))) for game in games)
+
+
+def publish_cancelled(game_keys):
+    """Tells the subscribers of each Game that it was cancelled"""
+    _send((game_key, json.dumps({'game': game_key.urlsafe(),
+                                 'cancelled': True}))
+          for game_key in game_keys)
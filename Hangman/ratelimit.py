@@ -0,0 +1,150 @@
+"""ratelimit.py - Admission control for the HangmanApi endpoints.
+
+rate_limit keeps a token bucket in memcache per endpoint and scope (game,
+user name, client address) and rejects a request once a bucket runs dry.
+shed_load rejects expensive requests outright while this instance is
+serving more than 'shed_load_in_flight' requests, so that cheap ones keep
+their latency. Both reject with 503: Endpoints only passes a fixed set of
+error statuses through, and 429 is not one of them. Limits are configured
+in Hangman.DEFAULTS['rate_limits']."""
+
+import functools
+import logging
+import math
+import time
+
+import endpoints
+from google.appengine.api import memcache
+
+from models import Hangman
+import instrumentation
+
+MEMCACHE_BUCKET = 'RATE_{}_{}_{}'
+
+# Attempts at a compare-and-set before treating a bucket as exhausted
+CAS_RETRIES = 5
+
+
+class ServiceUnavailableException(endpoints.ServiceException):
+    http_status = 503
+
+
+def _client_address(service):
+    try:
+        return service.request_state.remote_address or 'unknown'
+    except AttributeError:
+        # called directly, outside of an HTTP request
+        return 'local'
+
+
+def _user_name(request):
+    return request.user_name and request.user_name.strip().lower()
+
+
+# scope -> function (service, request) -> bucket identifier or None
+SCOPES = {
+    'game': lambda service, request: request.urlsafe_game_key,
+    'user': lambda service, request: _user_name(request),
+    'client': lambda service, request: _client_address(service),
+}
+
+
+def _refill(bucket, rate, burst, now):
+    """Returns the tokens of a (tokens, timestamp) bucket at now"""
+    if bucket is None:
+        return float(burst)
+    tokens, stamp = bucket
+    return min(float(burst), tokens + max(0.0, now - stamp) * rate)
+
+
+def take(buckets, cost=1):
+    """Takes cost tokens from every bucket.
+    Args:
+        buckets: A dict of memcache key -> (tokens per second, burst)
+        cost: Tokens to take; at most a full bucket is taken, so a large
+            batch is admitted whenever a bucket is full
+    Returns:
+        0 if the tokens were taken, else the seconds until the emptiest
+        bucket holds enough. If memcache is unavailable, requests are let
+        through."""
+    client = memcache.Client()
+    pending = dict(buckets)
+    for _ in range(CAS_RETRIES):
+        now = time.time()
+        stored = client.get_multi(pending.keys(), for_cas=True)
+        new, updated = {}, {}
+        for key, (rate, burst) in pending.items():
+            tokens = _refill(stored.get(key), rate, burst, now)
+            need = min(cost, burst)
+            if tokens < need:
+                return (need - tokens) / rate
+            target = updated if key in stored else new
+            target[key] = (tokens - need, now)
+        failed = []
+        if updated:
+            failed += client.cas_multi(updated, time=_ttl(pending))
+        if new:
+            not_added = client.add_multi(new, time=_ttl(pending))
+            if len(not_added) == len(pending) and \
+                    not client.get_multi(not_added):
+                # nothing could be read or added: memcache is down
+                logging.warning('Rate limiting skipped, memcache unavailable')
+                return 0
+            failed += not_added
+        if not failed:
+            return 0
+        pending = dict((key, pending[key]) for key in failed)
+    # lost every race for the bucket, so it is being hammered
+    return 1.0
+
+
+def _ttl(buckets):
+    # an expired bucket reads as full, so keep it only until it refills
+    return int(math.ceil(max(burst / float(rate)
+                             for rate, burst in buckets.values()))) + 1
+
+
+def rate_limit(name, cost=None):
+    """Decorates an endpoint method with the token buckets configured for
+    name in Hangman.DEFAULTS['rate_limits'].
+    Args:
+        name: Key of the limits, usually the endpoint name
+        cost: Optional function of the request returning the tokens it
+            takes, e.g. the number of items of a batch"""
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, request):
+            limits = Hangman.DEFAULTS['rate_limits'].get(name, {})
+            buckets = {}
+            for scope, (rate, burst) in limits.items():
+                identifier = SCOPES[scope](self, request)
+                if identifier:
+                    key = MEMCACHE_BUCKET.format(name, scope, identifier)
+                    buckets[key] = (rate, burst)
+            if buckets:
+                wait = take(buckets, cost(request) if cost else 1)
+                if wait:
+                    raise ServiceUnavailableException(
+                        'Rate limit exceeded, retry in {0:.0f} seconds'.format(
+                            math.ceil(wait)))
+            return method(self, request)
+        return wrapper
+    return decorator
+
+
+def shed_load(expensive):
+    """Decorates an endpoint method so that requests for which
+    expensive(request) is true are rejected while the instance is under
+    pressure"""
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, request):
+            limit = Hangman.DEFAULTS['shed_load_in_flight']
+            # the count includes this request
+            if limit and instrumentation.in_flight() > limit and \
+                    expensive(request):
+                raise ServiceUnavailableException(
+                    'Server busy, retry later or request a smaller page')
+            return method(self, request)
+        return wrapper
+    return decorator
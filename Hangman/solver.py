@@ -0,0 +1,107 @@
+"""solver.py - Hint engine and automated player. Candidate words are the
+dictionary words of the game's length that agree with its revealed letters
+and contain no guessed letter in an unrevealed position. Candidates are
+filtered with vectorized NumPy operations over the dictionary encoded as a
+(words x length) array of letter codes, and the result for each game pattern
+is cached, so hints for common states cost a dictionary lookup. The hint is
+the unguessed letter whose outcome (the positions it would reveal) splits
+the candidates most evenly, i.e. carries the most information."""
+
+import collections
+import string
+import threading
+
+import numpy as np
+
+import words
+
+# candidate sets kept, least recently used dropped first
+CACHE_SIZE = 2048
+
+Hint = collections.namedtuple('Hint', 'letter candidates')
+
+_encoded = {}
+_cache = collections.OrderedDict()
+_lock = threading.Lock()
+
+
+def _encode(length):
+    """Returns the dictionary words of a length as a (words x length)
+    array of letter codes 0-25, built once per length"""
+    encoded = _encoded.get(length)
+    if encoded is None:
+        packed = words.get_index().packed(length)
+        encoded = np.frombuffer(packed, dtype=np.uint8).reshape(-1, length) \
+            - ord('A')
+        _encoded[length] = encoded
+    return encoded
+
+
+def _codes(letters):
+    return [ord(letter) - ord('A') for letter in letters]
+
+
+def _filter(pattern, guessed):
+    if any(char != '_' and char not in string.ascii_uppercase
+           for char in pattern):
+        # dictionary words only hold letters A-Z
+        return np.zeros((0, len(pattern)), dtype=np.uint8)
+    encoded = _encode(len(pattern))
+    mask = np.ones(len(encoded), dtype=bool)
+    unknown = []
+    for position, char in enumerate(pattern):
+        if char == '_':
+            unknown.append(position)
+        else:
+            mask &= encoded[:, position] == ord(char) - ord('A')
+    if guessed and unknown:
+        # a guessed letter is either revealed everywhere or absent
+        excluded = np.zeros(26, dtype=bool)
+        excluded[_codes(guessed)] = True
+        mask &= ~excluded[encoded[:, unknown]].any(axis=1)
+    return encoded[mask]
+
+
+def _best_letter(candidates, guessed):
+    """Returns the unguessed letter maximizing the entropy of the reveal
+    pattern over the candidates, ties going to the likelier hit"""
+    unguessed = [letter for letter in words.LETTER_FREQUENCY_ORDER
+                 if letter not in guessed]
+    if not len(candidates):
+        # nothing in the dictionary fits, fall back to letter frequency
+        return unguessed[0] if unguessed else None
+    count = float(len(candidates))
+    weights = 1 << np.arange(candidates.shape[1], dtype=np.int64)
+    best, best_score = None, None
+    for letter in unguessed:
+        reveals = (candidates == ord(letter) - ord('A')).dot(weights)
+        _, inverse = np.unique(reveals, return_inverse=True)
+        shares = np.bincount(inverse) / count
+        entropy = -(shares * np.log2(shares)).sum()
+        score = (entropy, (reveals != 0).sum())
+        if best_score is None or score > best_score:
+            best, best_score = letter, score
+    return best
+
+
+def solve(pattern, guessed):
+    """Returns the Hint for a pattern ('_' for unrevealed letters) and the
+    letters guessed so far"""
+    key = (pattern, ''.join(sorted(guessed)))
+    with _lock:
+        hint = _cache.pop(key, None)
+        if hint is not None:
+            _cache[key] = hint
+            return hint
+    candidates = _filter(pattern, key[1])
+    hint = Hint(_best_letter(candidates, key[1]), len(candidates))
+    with _lock:
+        _cache[key] = hint
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return hint
+
+
+def hint(game):
+    """Returns the Hint for a Game in progress"""
+    return solve(game.pattern(), game.hits + game.misses)
@@ -1,34 +1,109 @@
 """utils.py - File for collecting general utility functions."""
 
+from google.appengine.api import datastore_errors
+from google.appengine.datastore.datastore_query import Cursor
 from google.appengine.ext import ndb
-import endpoints
 
-def get_by_urlsafe(urlsafe, model):
-    """Returns an ndb.Model entity that the urlsafe key points to. Checks
-        that the type of entity returned is of the correct kind. Raises an
-        error if the key String is malformed or the entity is of the incorrect
-        kind
+
+def _bad_request(message):
+    # endpoints is only loaded once a request is rejected, so the cron and
+    # task handlers using these helpers never import it
+    import endpoints
+    return endpoints.BadRequestException(message)
+
+
+def get_key_by_urlsafe(urlsafe, model):
+    """Returns the ndb.Key a urlsafe key string encodes, without fetching
+        the entity. Raises an error if the key String is malformed or points
+        to an entity of the incorrect kind
     Args:
         urlsafe: A urlsafe key string
         model: The expected entity kind
     Returns:
-        The entity that the urlsafe Key string points to or None if no entity
-        exists.
+        The ndb.Key the urlsafe Key string encodes.
     Raises:
         ValueError:"""
     try:
         key = ndb.Key(urlsafe=urlsafe)
     except TypeError:
-        raise endpoints.BadRequestException('Invalid Key')
+        raise _bad_request('Invalid Key')
     except Exception, e:
         if e.__class__.__name__ == 'ProtocolBufferDecodeError':
-            raise endpoints.BadRequestException('Invalid Key')
+            raise _bad_request('Invalid Key')
         else:
             raise
 
-    entity = key.get()
-    if not entity:
-        return None
-    if not isinstance(entity, model):
+    if key.kind() != model._get_kind():
         raise ValueError('Incorrect Kind')
-    return entity
+    return key
+
+
+def get_by_urlsafe(urlsafe, model):
+    """Returns an ndb.Model entity that the urlsafe key points to. Checks
+        that the type of entity returned is of the correct kind. Raises an
+        error if the key String is malformed or the entity is of the incorrect
+        kind
+    Args:
+        urlsafe: A urlsafe key string
+        model: The expected entity kind
+    Returns:
+        The entity that the urlsafe Key string points to or None if no entity
+        exists.
+    Raises:
+        ValueError:"""
+    return get_key_by_urlsafe(urlsafe, model).get()
+
+
+def get_multi_map(keys):
+    """Resolves a list of keys with a single batched get.
+    Args:
+        keys: An iterable of ndb.Keys, possibly containing duplicates or None
+    Returns:
+        A dict mapping each distinct key to its entity (or None if no entity
+        exists for that key)."""
+    unique_keys = list(set(key for key in keys if key is not None))
+    return dict(zip(unique_keys, ndb.get_multi(unique_keys)))
+
+
+def fetch_page(query, page_size, urlsafe_cursor=None, **options):
+    """Fetches one page of query results starting at an opaque cursor.
+    Args:
+        query: The ndb.Query to page through
+        page_size: Maximum number of results to return
+        urlsafe_cursor: A cursor string returned by a previous call, or None
+            to start at the beginning
+        options: Extra query options (e.g. keys_only) passed to fetch_page
+    Returns:
+        A (results, next_cursor) tuple. next_cursor is a urlsafe cursor string
+        for the following page, or None if there are no more results.
+    Raises:
+        endpoints.BadRequestException: If the cursor string is malformed."""
+    try:
+        cursor = Cursor(urlsafe=urlsafe_cursor) if urlsafe_cursor else None
+    except (datastore_errors.BadValueError, TypeError):
+        raise _bad_request('Invalid cursor')
+    results, next_cursor, more = query.fetch_page(page_size,
+                                                  start_cursor=cursor,
+                                                  **options)
+    if more and next_cursor:
+        return results, next_cursor.urlsafe()
+    return results, None
+
+
+def fetch_keys_page(query, page_size, urlsafe_cursor=None):
+    """Fetches one page of entities with a keys-only query followed by a
+    batched get, so entities already in ndb's memcache cache are not read
+    from the datastore again. Cursors are interchangeable with fetch_page
+    on the same query.
+    Args:
+        query: The ndb.Query to page through
+        page_size: Maximum number of results to return
+        urlsafe_cursor: A cursor string returned by a previous call, or None
+            to start at the beginning
+    Returns:
+        A (entities, next_cursor) tuple, as fetch_page. Entities deleted
+        since the query ran are left out."""
+    keys, next_cursor = fetch_page(query, page_size, urlsafe_cursor,
+                                   keys_only=True)
+    entities = [entity for entity in ndb.get_multi(keys) if entity is not None]
+    return entities, next_cursor
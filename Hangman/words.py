@@ -0,0 +1,130 @@
+"""words.py - Dictionary-backed word source for new games. The word list is
+loaded once per instance, on first use, into a compact index: for every word
+length and difficulty there is one string holding all of its words back to
+back at a fixed width. Picking a random word is a slice at a random offset,
+and the whole dictionary costs little more memory than its characters."""
+
+import bisect
+import os
+import random
+import threading
+
+WORD_LIST = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                         'words.txt')
+MIN_LENGTH = 3
+MAX_LENGTH = 20
+
+# English letters, most frequent first
+LETTER_FREQUENCY_ORDER = 'ETAOINSHRDLCUMWFGYPBVKJXQZ'
+LETTER_RANK = dict((letter, rank)
+                   for rank, letter in enumerate(LETTER_FREQUENCY_ORDER))
+
+EASY, MEDIUM, HARD = 'EASY', 'MEDIUM', 'HARD'
+DIFFICULTIES = (EASY, MEDIUM, HARD)
+
+
+def difficulty_score(word):
+    """Scores how hard a word is to guess. Rare letters make it harder, more
+    distinct letters (more chances of a hit) make it easier."""
+    distinct = set(word)
+    rarity = sum(LETTER_RANK[letter] for letter in distinct) / float(len(distinct))
+    return rarity - len(distinct)
+
+
+class WordIndex(object):
+    """Words bucketed by (length, difficulty), each bucket a single string of
+    fixed-width words"""
+
+    def __init__(self, words):
+        scored = sorted((difficulty_score(word), word) for word in set(words))
+        lists = {}
+        for position, (_, word) in enumerate(scored):
+            # difficulty tiers are the tertiles of the score
+            tier = DIFFICULTIES[position * len(DIFFICULTIES) // len(scored)]
+            lists.setdefault((len(word), tier), []).append(word)
+        self._buckets = dict((key, ''.join(bucket))
+                             for key, bucket in lists.items())
+        self._selections = {}
+
+    def __len__(self):
+        return sum(len(bucket) // length
+                   for (length, _), bucket in self._buckets.items())
+
+    def _selection(self, length, difficulty):
+        # buckets matching a filter with their cumulative word counts,
+        # computed once per distinct filter
+        key = (length, difficulty)
+        if key not in self._selections:
+            keys, cumulative, total = [], [], 0
+            for bucket_key in sorted(self._buckets):
+                if length is not None and bucket_key[0] != length:
+                    continue
+                if difficulty is not None and bucket_key[1] != difficulty:
+                    continue
+                total += len(self._buckets[bucket_key]) // bucket_key[0]
+                keys.append(bucket_key)
+                cumulative.append(total)
+            self._selections[key] = (keys, cumulative)
+        return self._selections[key]
+
+    def count(self, length=None, difficulty=None):
+        """Returns the number of words matching the filter"""
+        cumulative = self._selection(length, difficulty)[1]
+        return cumulative[-1] if cumulative else 0
+
+    def choose(self, length=None, difficulty=None, rng=random):
+        """Returns a random word of the given length and/or difficulty, or
+        None if no word matches"""
+        keys, cumulative = self._selection(length, difficulty)
+        if not keys:
+            return None
+        number = rng.randrange(cumulative[-1])
+        position = bisect.bisect_right(cumulative, number)
+        if position:
+            number -= cumulative[position - 1]
+        word_length = keys[position][0]
+        start = number * word_length
+        return self._buckets[keys[position]][start:start + word_length]
+
+    def packed(self, length):
+        """Returns every word of a length concatenated in one string"""
+        return ''.join(self._buckets.get((length, difficulty), '')
+                       for difficulty in DIFFICULTIES)
+
+    def words(self, length):
+        """Yields every word of a length"""
+        for difficulty in DIFFICULTIES:
+            bucket = self._buckets.get((length, difficulty), '')
+            for start in range(0, len(bucket), length):
+                yield bucket[start:start + length]
+
+
+def read_words(path):
+    """Yields the usable words of a word list file, one word per line.
+    Words are upper-cased; words with characters other than A-Z or outside
+    MIN_LENGTH..MAX_LENGTH are skipped."""
+    with open(path) as f:
+        for line in f:
+            word = line.strip().upper()
+            if (MIN_LENGTH <= len(word) <= MAX_LENGTH and
+                    all(char in LETTER_RANK for char in word)):
+                yield word
+
+
+_index = None
+_lock = threading.Lock()
+
+
+def get_index():
+    """Returns the instance-wide WordIndex, loading it on first use"""
+    global _index
+    if _index is None:
+        with _lock:
+            if _index is None:
+                _index = WordIndex(read_words(WORD_LIST))
+    return _index
+
+
+def choose(length=None, difficulty=None):
+    """Returns a random dictionary word, or None if no word matches"""
+    return get_index().choose(length, difficulty)
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+
+"""bench_batch.py - Throughput and datastore RPCs of the batch endpoints
+against the equivalent sequence of single-call endpoints: creating games,
+playing one guess in each and cancelling them.
+
+Usage: python bench_batch.py [game_count]"""
+
+import sys
+import time
+
+import common
+
+
+def timed(counter, function):
+    counter.reset()
+    start = time.time()
+    function()
+    return time.time() - start, counter.total()
+
+
+def main(argv):
+    common.setup_paths()
+    game_count = int(argv[0]) if argv else 100
+    import api
+    from models import User
+    from forms import NewGameForm, BatchNewGameForm, BatchMoveForm,\
+        BatchMakeMoveForm, BatchCancelGameForm
+
+    bed = common.activate_testbed()
+    try:
+        with common.rate_limits_disabled():
+            counter = common.RpcCounter()
+            counter.install()
+            service = api.HangmanApi()
+            User.create('bencher')
+            results = {}
+
+            # single calls
+            keys = []
+            def single_new():
+                for _ in range(game_count):
+                    keys.append(service.new_game(
+                        api.NEW_GAME_REQUEST.combined_message_class(
+                            user_name='bencher', word='HANGMAN')).urlsafe_key)
+            def single_move():
+                for key in keys:
+                    service.make_move(api.MAKE_MOVE_REQUEST.combined_message_class(
+                        urlsafe_game_key=key, guess='A'))
+            def single_cancel():
+                for key in keys:
+                    service.cancel_game(api.GET_GAME_REQUEST.combined_message_class(
+                        urlsafe_game_key=key))
+            results['single'] = [timed(counter, single_new),
+                                 timed(counter, single_move),
+                                 timed(counter, single_cancel)]
+
+            # batches
+            batch_keys = []
+            def batch_new():
+                response = service.batch_new_game(BatchNewGameForm(items=[
+                    NewGameForm(user_name='bencher', word='HANGMAN')
+                    for _ in range(game_count)]))
+                batch_keys.extend(item.game.urlsafe_key for item in response.items)
+            def batch_move():
+                service.batch_make_move(BatchMakeMoveForm(items=[
+                    BatchMoveForm(urlsafe_game_key=key, guess='A')
+                    for key in batch_keys]))
+            def batch_cancel():
+                service.batch_cancel_game(BatchCancelGameForm(
+                    urlsafe_game_keys=batch_keys))
+            results['batch'] = [timed(counter, batch_new),
+                                timed(counter, batch_move),
+                                timed(counter, batch_cancel)]
+
+            print '{:>8} {:>12} {:>14} {:>10}'.format('mode', 'operation',
+                                                      'games/second', 'RPCs')
+            for mode in ('single', 'batch'):
+                for operation, (seconds, rpcs) in zip(
+                        ('new_game', 'make_move', 'cancel_game'), results[mode]):
+                    print '{:>8} {:>12} {:>14.1f} {:>10}'.format(
+                        mode, operation, game_count / seconds, rpcs)
+    finally:
+        bed.deactivate()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
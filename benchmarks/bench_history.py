@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+
+"""bench_history.py - Compares the legacy JSON-per-move Game history against
+the packed 'moves' string: encoded entity size, index rows written per put
+and put latency on the local datastore stub.
+
+Usage: python bench_history.py [move_count ...]"""
+
+import json
+import string
+import sys
+import time
+
+import common
+
+PUTS = 200
+
+
+def build(move_count, legacy):
+    from models import Game, User
+    from google.appengine.ext import ndb
+    word = string.ascii_uppercase
+    game = Game(user=ndb.Key(User, 1), word=word)
+    for guess in word[:move_count]:
+        if legacy:
+            game.history.append(json.dumps({'Guess': guess, 'Result': 'Hit!'}))
+        else:
+            game.moves += guess
+    return game
+
+
+def index_rows(game, indexed_history):
+    # built-in indexes write an ascending and a descending row per indexed
+    # value; the legacy layout indexed every history element
+    pb = game._to_pb()
+    return 2 * (pb.property_size() +
+                (len(game.history) if indexed_history else 0))
+
+
+def measure(move_count, legacy):
+    game = build(move_count, legacy)
+    size = game._to_pb().ByteSize()
+    start = time.time()
+    for _ in range(PUTS):
+        game.key = None
+        game.put()
+    latency_ms = (time.time() - start) * 1000.0 / PUTS
+    return size, index_rows(game, legacy), latency_ms
+
+
+def main(argv):
+    common.setup_paths()
+    move_counts = [int(arg) for arg in argv] or [6, 12, 26]
+    bed = common.activate_testbed()
+    try:
+        print '{:>6} {:>8} {:>10} {:>10} {:>11}'.format(
+            'moves', 'layout', 'bytes', 'index rows', 'put ms')
+        for move_count in move_counts:
+            for legacy in (True, False):
+                size, rows, latency_ms = measure(move_count, legacy)
+                print '{:>6} {:>8} {:>10} {:>10} {:>11.3f}'.format(
+                    move_count, 'json' if legacy else 'packed', size, rows,
+                    latency_ms)
+    finally:
+        bed.deactivate()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+
+"""bench_imports.py - Cold import cost of each Hangman module: wall time,
+number of modules loaded and whether the import pulls in the Endpoints
+stack, protorpc or NumPy. Every module is imported in a fresh interpreter,
+the way a new instance loads it. With --before REV the same figures are
+taken for the app as of git revision REV, for comparison.
+
+Usage: python bench_imports.py [--before REV] [module ...]"""
+
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+import common
+
+MODULES = ['models', 'forms', 'utils', 'leaderboard', 'main', 'api']
+REPEATS = 5
+HEAVY = ('endpoints', 'protorpc', 'numpy')
+
+PROBE = """
+import json, sys, time
+sys.path.insert(0, %(bench)r)
+import common
+common.setup_paths()
+sys.path.insert(0, %(app)r)
+before = set(sys.modules)
+start = time.time()
+__import__(%(module)r)
+elapsed = time.time() - start
+loaded = set(name for name in sys.modules
+             if name not in before and sys.modules[name] is not None)
+print json.dumps({'ms': elapsed * 1000.0, 'modules': len(loaded),
+                  'heavy': [heavy for heavy in %(heavy)r if heavy in loaded]})
+"""
+
+
+def probe(app_path, module):
+    """Imports module in a fresh interpreter REPEATS times; returns the
+    median time with the module count and heavy packages loaded"""
+    code = PROBE % {'bench': os.path.dirname(os.path.abspath(__file__)),
+                    'app': app_path, 'module': module, 'heavy': HEAVY}
+    runs = []
+    for _ in range(REPEATS):
+        output = subprocess.check_output([sys.executable, '-c', code],
+                                         cwd=app_path)
+        runs.append(json.loads(output.strip().splitlines()[-1]))
+    runs.sort(key=lambda run: run['ms'])
+    return runs[len(runs) // 2]
+
+
+def export(revision):
+    """Checks the app out of a git revision into a temporary directory"""
+    target = tempfile.mkdtemp(prefix='hangman-')
+    root = subprocess.check_output(['git', 'rev-parse', '--show-toplevel'],
+                                   cwd=common.APP_PATH).strip()
+    archive = subprocess.Popen(['git', 'archive', revision, 'Hangman'],
+                               cwd=root, stdout=subprocess.PIPE)
+    subprocess.check_call(['tar', '-x', '-C', target], stdin=archive.stdout)
+    archive.wait()
+    return target
+
+
+def main(argv):
+    before = None
+    if argv[:1] == ['--before']:
+        before, argv = argv[1], argv[2:]
+    modules = argv or MODULES
+    trees = [('after', os.path.abspath(common.APP_PATH), None)]
+    if before:
+        export_dir = export(before)
+        trees.insert(0, ('before', os.path.join(export_dir, 'Hangman'),
+                         export_dir))
+    try:
+        print '{:>12} {:>7} {:>9} {:>8}  {}'.format('module', 'tree', 'ms',
+                                                    'modules', 'loads')
+        for module in modules:
+            for label, path, _ in trees:
+                if not os.path.exists(os.path.join(path, module + '.py')):
+                    continue
+                result = probe(path, module)
+                print '{:>12} {:>7} {:>9.1f} {:>8}  {}'.format(
+                    module, label, result['ms'], result['modules'],
+                    ', '.join(result['heavy']) or '-')
+    finally:
+        for _, _, export_dir in trees:
+            if export_dir:
+                shutil.rmtree(export_dir)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+
+"""bench_leaderboard.py - Datastore round trips per get_high_scores and
+get_user_rankings request (one page of MAX_PAGE_SIZE rows) as the number of
+stored rows grows.
+
+Usage: python bench_leaderboard.py [row_count ...]"""
+
+import sys
+
+import common
+
+
+def seed(row_count):
+    from datetime import date
+    from google.appengine.ext import ndb
+    from models import User, Game, Score, UserRecord
+    users = [User(key=User.key_for('user{}'.format(i)), name='user{}'.format(i))
+             for i in range(max(1, row_count // 10))]
+    ndb.put_multi(users)
+    ndb.put_multi([UserRecord(key=UserRecord.key_for(user.key), user=user.key,
+                              wins=i) for i, user in enumerate(users)])
+    games = [Game(user=users[i % len(users)].key, word='HANGMAN', game_over=True)
+             for i in range(row_count)]
+    ndb.put_multi(games)
+    ndb.put_multi([Score(user=game.user, game=game.key, date=date.today(),
+                         won=True, score=i) for i, game in enumerate(games)])
+
+
+def measure(row_count):
+    from google.appengine.ext import ndb
+    from api import HangmanApi, GET_HIGH_SCORES_REQUEST, PAGE_REQUEST,\
+        MAX_PAGE_SIZE
+
+    bed = common.activate_testbed()
+    try:
+        seed(row_count)
+        counter = common.RpcCounter()
+        counter.install()
+        api = HangmanApi()
+        results = {}
+        for name, call in (
+                ('get_high_scores', lambda: api.get_high_scores(
+                    GET_HIGH_SCORES_REQUEST.combined_message_class(
+                        page_size=MAX_PAGE_SIZE))),
+                ('get_user_rankings', lambda: api.get_user_rankings(
+                    PAGE_REQUEST.combined_message_class(
+                        page_size=MAX_PAGE_SIZE)))):
+            ndb.get_context().clear_cache()
+            counter.reset()
+            call()
+            results[name] = counter.total()
+        return results
+    finally:
+        bed.deactivate()
+
+
+def main(argv):
+    common.setup_paths()
+    row_counts = [int(arg) for arg in argv] or [10, 100, 1000]
+    print '{:>8} {:>16} {:>18}'.format('rows', 'get_high_scores',
+                                       'get_user_rankings')
+    for row_count in row_counts:
+        results = measure(row_count)
+        print '{:>8} {:>16} {:>18}'.format(row_count,
+                                           results['get_high_scores'],
+                                           results['get_user_rankings'])
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
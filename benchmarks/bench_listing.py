@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+
+"""bench_listing.py - Datastore bytes read and latency per listed game of
+get_user_games, comparing a full entity query (the previous behaviour), the
+keys-only query plus batched get of view=FULL (with cold and warm memcache)
+and the projection query of view=SUMMARY.
+
+Usage: python bench_listing.py [games_per_page] [moves_per_game]"""
+
+import json
+import string
+import sys
+import time
+
+import common
+
+REPEATS = 20
+
+
+def seed(game_count, move_count):
+    from google.appengine.ext import ndb
+    from models import User, Game
+    user = User(key=User.key_for('lister'), name='lister')
+    user.put()
+    games = []
+    for _ in range(game_count):
+        game = Game.build(user.key, string.ascii_uppercase)
+        for guess in string.ascii_uppercase[:move_count]:
+            game.guess(guess)
+            game.record_move(guess)
+            # games started before the packed move history still carry it
+            game.history.append(json.dumps({'Guess': guess, 'Result': 'Hit!'}))
+        games.append(game)
+    ndb.put_multi(games)
+    return user
+
+
+def main(argv):
+    common.setup_paths()
+    game_count = int(argv[0]) if argv else 20
+    move_count = int(argv[1]) if len(argv) > 1 else 12
+    # Endpoints reads the app version while api is imported, which fails
+    # under the testbed's environment
+    from google.appengine.api import memcache
+    from google.appengine.ext import ndb
+    from api import HangmanApi, GET_USER_GAMES_REQUEST
+    from models import Game
+    from forms import ListView
+    bed = common.activate_testbed()
+    try:
+        user = seed(game_count, move_count)
+        recorder = common.ThreadRpcRecorder()
+        recorder.install()
+        api = HangmanApi()
+
+        def listing(view):
+            return lambda: api.get_user_games(
+                GET_USER_GAMES_REQUEST.combined_message_class(
+                    urlsafe_user_key=user.key.urlsafe(),
+                    page_size=game_count, view=view))
+
+        def entity_query():
+            query = Game.query(Game.user == user.key,
+                               Game.game_over == False).order(-Game.created)
+            return [game.to_form('') for game in query.fetch(game_count)]
+
+        modes = (('entity query', entity_query, True),
+                 ('keys-only, cold', listing(ListView.FULL), True),
+                 ('keys-only, warm', listing(ListView.FULL), False),
+                 ('projection', listing(ListView.SUMMARY), True))
+        print '{} games of {} moves per page'.format(game_count, move_count)
+        print '{:>16} {:>6} {:>14} {:>16}'.format('mode', 'rpcs',
+                                                   'bytes/game', 'ms/game')
+        for name, call, cold in modes:
+            elapsed = 0.0
+            for _ in range(REPEATS):
+                if cold:
+                    memcache.flush_all()
+                ndb.get_context().clear_cache()
+                recorder.take()
+                start = time.time()
+                call()
+                elapsed += time.time() - start
+                rpcs, read = recorder.take()
+            print '{:>16} {:>6} {:>14.0f} {:>16.3f}'.format(
+                name, rpcs, read / float(game_count),
+                elapsed * 1000.0 / REPEATS / game_count)
+    finally:
+        bed.deactivate()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
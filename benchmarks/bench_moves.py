@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+
+"""bench_moves.py - Micro-benchmark of move evaluation on long words and
+phrases: the list membership / str.count checks make_move used to run
+against the Game letter index and bitmasks. Both evaluate every letter A-Z
+against a prebuilt mid-game state (every other letter guessed), so only the
+per-move checks are timed; building the index is a one-off cost per game
+and is reported in its own column. For short words the list checks can
+well be the cheaper ones.
+
+Usage: python bench_moves.py [repeat]"""
+
+import string
+import sys
+import timeit
+
+import common
+
+WORDS = {
+    'word': 'HANGMAN',
+    'long word': 'PNEUMONOULTRAMICROSCOPICSILICOVOLCANOCONIOSIS',
+    'phrase': 'THE-QUICK-BROWN-FOX-JUMPS-OVER-THE-LAZY-DOG' * 20,
+}
+
+GUESSED = string.ascii_uppercase[::2]
+
+
+def legacy_state(word):
+    hits = [letter for letter in GUESSED if letter in word]
+    misses = [letter for letter in GUESSED if letter not in word]
+    return word, hits, misses
+
+
+def legacy_moves(state):
+    # the checks make_move ran before the letter index existed
+    word, hits, misses = state
+    for letter in string.ascii_uppercase:
+        if letter in hits or letter in misses:
+            continue
+        if letter in word:
+            word.count(letter)
+
+
+def indexed_state(word):
+    from models import Game
+    game = Game(word=word, hits=[letter for letter in GUESSED if letter in word],
+                misses=[letter for letter in GUESSED if letter not in word])
+    game.index_word()
+    return game
+
+
+def indexed_moves(game):
+    for letter in string.ascii_uppercase:
+        if game.is_guessed(letter):
+            continue
+        positions = game.letter_positions.get(letter)
+        if positions:
+            len(positions)
+
+
+def main(argv):
+    common.setup_paths()
+    repeat = int(argv[0]) if argv else 1000
+    letters = float(len(string.ascii_uppercase))
+    print '{:>10} {:>7} {:>12} {:>12} {:>10}'.format(
+        'input', 'length', 'legacy us', 'indexed us', 'index us')
+    for name, word in sorted(WORDS.items()):
+        results = []
+        for build, moves in ((legacy_state, legacy_moves),
+                             (indexed_state, indexed_moves)):
+            state = build(word)
+            seconds = timeit.timeit(lambda: moves(state), number=repeat)
+            results.append(seconds / repeat / letters * 1e6)
+        game = indexed_state(word)
+        seconds = timeit.timeit(game.index_word, number=repeat)
+        results.append(seconds / repeat * 1e6)
+        print '{:>10} {:>7} {:>12.2f} {:>12.2f} {:>10.2f}'.format(
+            name, len(word), *results)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
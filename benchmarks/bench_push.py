@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+
+"""bench_push.py - Read load of spectators following a game by polling
+get_game after every move against subscribing once with subscribe_game and
+receiving pushed state over the in-process transport. Reports datastore
+RPCs, entity bytes and spectator-side time per move, and checks every
+subscriber ends up with the final state.
+
+Usage: python bench_push.py [spectators ...]"""
+
+import json
+import sys
+import time
+
+import common
+
+WORD = 'ABCDEFGHIJKLMNOPQRSTUVWXY'
+GUESSES = 'ABCDEFGHIJKL'
+
+
+def play(api, recorder, spectators, push_mode):
+    from api import USER_REQUEST, NEW_GAME_REQUEST, GET_GAME_REQUEST,\
+        MAKE_MOVE_REQUEST
+    import push
+    name = 'player-{}-{}'.format(spectators, push_mode)
+    api.create_user(USER_REQUEST.combined_message_class(user_name=name))
+    game_key = api.new_game(NEW_GAME_REQUEST.combined_message_class(
+        user_name=name, word=WORD)).urlsafe_key
+    get_request = GET_GAME_REQUEST.combined_message_class(
+        urlsafe_game_key=game_key)
+    clients = []
+    if push_mode:
+        clients = [api.subscribe_game(get_request).client_id
+                   for _ in range(spectators)]
+    transport = push.get_transport()
+
+    rpcs = read = 0
+    elapsed = 0.0
+    states = {}
+    for guess in GUESSES:
+        api.make_move(MAKE_MOVE_REQUEST.combined_message_class(
+            urlsafe_game_key=game_key, guess=guess))
+        recorder.take()
+        start = time.time()
+        if push_mode:
+            for client_id in clients:
+                for message in transport.receive(client_id):
+                    states[client_id] = json.loads(message)
+        else:
+            for spectator in range(spectators):
+                states[spectator] = api.get_game(get_request)
+        elapsed += time.time() - start
+        spectator_rpcs, spectator_read = recorder.take()
+        rpcs += spectator_rpcs
+        read += spectator_read
+    final = api.get_game(get_request)
+    if push_mode:
+        ok = all(state['masked_word'] == final.masked_word and
+                 state['seq'] == len(GUESSES) for state in states.values())
+    else:
+        ok = all(state.masked_word == final.masked_word
+                 for state in states.values())
+    moves = float(len(GUESSES))
+    return rpcs / moves, read / moves, elapsed * 1000.0 / moves, ok
+
+
+def main(argv):
+    common.setup_paths()
+    counts = [int(arg) for arg in argv] or [1, 10, 100]
+    # Endpoints reads the app version while api is imported, which fails
+    # under the testbed's environment
+    from models import Hangman
+    from api import HangmanApi
+    import push
+    bed = common.activate_testbed()
+    try:
+        with common.rate_limits_disabled():
+            Hangman.DEFAULTS['push_transport'] = 'local'
+            push.set_transport(push.LocalTransport())
+            api = HangmanApi()
+            recorder = common.ThreadRpcRecorder()
+            recorder.install()
+            print '{:>10} {:>6} {:>10} {:>12} {:>10} {:>4}'.format(
+                'spectators', 'mode', 'rpcs/move', 'bytes/move', 'ms/move', 'ok')
+            for spectators in counts:
+                for push_mode in (False, True):
+                    rpcs, read, ms, ok = play(api, recorder, spectators,
+                                              push_mode)
+                    print '{:>10} {:>6} {:>10.1f} {:>12.0f} {:>10.3f} {:>4}'.format(
+                        spectators, 'push' if push_mode else 'poll', rpcs, read,
+                        ms, 'yes' if ok else 'NO')
+    finally:
+        bed.deactivate()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
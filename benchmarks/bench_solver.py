@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+
+"""bench_solver.py - Plays full games with the solver and reports hint
+latency (first request per pattern and cached) and the solver's win rate.
+Needs NumPy but no App Engine SDK.
+
+Usage: python bench_solver.py [games] [word_list]"""
+
+import random
+import sys
+import time
+
+import common
+
+GUESS_LIMIT = 6
+
+
+def play(solver, word):
+    """Plays one game, returning (won, hint latencies in ms)"""
+    guessed, misses, latencies = [], 0, []
+    while misses < GUESS_LIMIT:
+        pattern = ''.join(char if char in guessed else '_' for char in word)
+        if '_' not in pattern:
+            return True, latencies
+        start = time.time()
+        letter = solver.solve(pattern, guessed).letter
+        latencies.append((time.time() - start) * 1000.0)
+        guessed.append(letter)
+        if letter not in word:
+            misses += 1
+    return False, latencies
+
+
+def main(argv):
+    sys.path.insert(0, common.APP_PATH)
+    import words
+    import solver
+    game_count = int(argv[0]) if argv else 1000
+    if len(argv) > 1:
+        words.WORD_LIST = argv[1]
+    start = time.time()
+    index = words.get_index()
+    load_ms = (time.time() - start) * 1000.0
+
+    rng = random.Random(0)
+    targets = [index.choose(rng=rng) for _ in range(game_count)]
+    results = {}
+    for label in ('first', 'cached'):
+        won, latencies = 0, []
+        for word in targets:
+            game_won, game_latencies = play(solver, word)
+            won += game_won
+            latencies.extend(game_latencies)
+        latencies.sort()
+        results[label] = (won, latencies)
+
+    print 'dictionary words:  {} (loaded in {:.0f} ms)'.format(len(index),
+                                                              load_ms)
+    for label in ('first', 'cached'):
+        won, latencies = results[label]
+        print '{:>6} pass: win rate {:.1%}, hint p50 {:.3f} ms, ' \
+              'p99 {:.3f} ms, max {:.3f} ms'.format(
+                  label, won / float(game_count),
+                  common.percentile(latencies, 0.50),
+                  common.percentile(latencies, 0.99), latencies[-1])
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+
+"""bench_windows.py - Daily and weekly high scores read from ScoreRollups
+against a raw scan of the Scores in the window: datastore RPCs, bytes read
+and latency per request. Scores are spread over three weeks, so the probes
+cover both sides of day and week boundaries; every probe checks that the
+rollups list the same Scores as the raw scan, before and after the
+compaction cron has run.
+
+Usage: python bench_windows.py [score_count]"""
+
+import random
+import sys
+import time
+from datetime import date, timedelta
+
+import common
+
+REPEATS = 10
+# a Monday, so the spread covers whole weeks
+FIRST_DAY = date(2016, 1, 4)
+DAYS = 21
+
+
+def seed(score_count):
+    from google.appengine.ext import ndb
+    from models import User, Game, Score
+    import leaderboard
+    users = [User(key=User.key_for('user{}'.format(i)), name='user{}'.format(i))
+             for i in range(10)]
+    ndb.put_multi(users)
+    rng = random.Random(0)
+    for i in range(score_count):
+        user = users[i % len(users)]
+        game = Game.build(user.key, 'HANGMAN')
+        game.game_over = game.game_won = True
+        game.put()
+        # distinct scores, so both sides agree on the order of every row
+        score = Score(user=user.key, game=game.key, won=True, score=i,
+                      date=FIRST_DAY + timedelta(days=rng.randrange(DAYS)))
+        score.put()
+        leaderboard.record_score_async(score, user, game).get_result()
+
+
+def raw_scan(window, day):
+    """Ranks the window from the raw Score rows"""
+    from models import Score
+    import leaderboard
+    if window == leaderboard.DAILY:
+        start, end = day, day + timedelta(days=1)
+    else:
+        start = leaderboard.week_start(day)
+        end = start + timedelta(days=7)
+    scores = Score.query(Score.date >= start, Score.date < end).fetch()
+    scores.sort(key=lambda score: -score.score)
+    scores = scores[:leaderboard.TOP_N]
+    return [(score.key.urlsafe(), form) for score, form in
+            zip(scores, Score.to_forms(scores))]
+
+
+def measure(recorder, call):
+    from google.appengine.ext import ndb
+    elapsed = 0.0
+    for _ in range(REPEATS):
+        ndb.get_context().clear_cache()
+        recorder.take()
+        start = time.time()
+        result = call()
+        elapsed += time.time() - start
+        rpcs, read = recorder.take()
+    return result, rpcs, read, elapsed * 1000.0 / REPEATS
+
+
+def main(argv):
+    common.setup_paths()
+    score_count = int(argv[0]) if argv else 1000
+    bed = common.activate_testbed()
+    try:
+        import leaderboard
+        seed(score_count)
+        recorder = common.ThreadRpcRecorder()
+        recorder.install()
+        # Sunday and Monday either side of each week boundary, plus midweek
+        probes = [(window, FIRST_DAY + timedelta(days=offset))
+                  for window in (leaderboard.DAILY, leaderboard.WEEKLY)
+                  for offset in (0, 3, 6, 7, 13, 14, 20)]
+        print '{} scores over {} days from {}'.format(score_count, DAYS,
+                                                      FIRST_DAY)
+        print '{:>8} {:>12} {:>9} {:>6} {:>10} {:>9} {:>6}'.format(
+            'window', 'day', 'source', 'rpcs', 'bytes', 'ms', 'match')
+        for stage in ('rollups', 'compacted'):
+            if stage == 'compacted':
+                today = FIRST_DAY + timedelta(
+                    days=DAYS + leaderboard.DAILY_RETENTION_DAYS + 7)
+                print 'compacted {} weeks'.format(
+                    leaderboard.compact_rollups(today))
+            for window, day in probes:
+                if stage == 'compacted' and window == leaderboard.DAILY:
+                    continue
+                raw, raw_rpcs, raw_read, raw_ms = measure(
+                    recorder, lambda: raw_scan(window, day))
+                entries, rpcs, read, ms = measure(
+                    recorder, lambda: leaderboard.window_entries(window, day))
+                match = [entry['key'] for entry in entries] == \
+                        [key for key, _ in raw]
+                for source, row in (('raw scan', (raw_rpcs, raw_read, raw_ms)),
+                                    (stage, (rpcs, read, ms))):
+                    print '{:>8} {:>12} {:>9} {:>6} {:>10} {:>9.3f} {:>6}'.format(
+                        window, day, source, row[0], row[1], row[2],
+                        'yes' if match else 'NO')
+    finally:
+        bed.deactivate()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+
+"""bench_words.py - Start-up time, memory and sampling cost of the words.py
+dictionary index on a synthetic word list, against keeping the words as a
+plain list of strings. Needs no App Engine SDK.
+
+Usage: python bench_words.py [word_count]"""
+
+import os
+import random
+import sys
+import tempfile
+import time
+import timeit
+
+import common
+
+# rough English letter weights, most frequent first
+WEIGHTS = [12, 9, 8, 8, 7, 7, 6, 6, 6, 4, 4, 3, 3, 2, 2, 2, 2, 2, 2, 1, 1, 1,
+           1, 1, 1, 1]
+
+
+def write_word_list(word_count, rng):
+    letters = ''.join(letter * weight for letter, weight in
+                      zip('ETAOINSHRDLCUMWFGYPBVKJXQZ', WEIGHTS))
+    handle, path = tempfile.mkstemp(suffix='.txt')
+    with os.fdopen(handle, 'w') as f:
+        for _ in range(word_count):
+            length = rng.randint(4, 12)
+            f.write(''.join(rng.choice(letters) for _ in range(length)) + '\n')
+    return path
+
+
+def main(argv):
+    sys.path.insert(0, common.APP_PATH)
+    word_count = int(argv[0]) if argv else 200000
+    rng = random.Random(0)
+    path = write_word_list(word_count, rng)
+    try:
+        start = time.time()
+        import words
+        import_ms = (time.time() - start) * 1000.0
+
+        start = time.time()
+        index = words.WordIndex(words.read_words(path))
+        load_ms = (time.time() - start) * 1000.0
+        index_bytes = sum(sys.getsizeof(bucket)
+                          for bucket in index._buckets.values())
+
+        plain = list(words.read_words(path))
+        plain_bytes = sys.getsizeof(plain) + sum(sys.getsizeof(word)
+                                                 for word in plain)
+
+        repeat = 100000
+        sample_us = timeit.timeit(
+            lambda: index.choose(8, words.HARD, rng), number=repeat) \
+            / repeat * 1e6
+        any_us = timeit.timeit(lambda: index.choose(rng=rng),
+                               number=repeat) / repeat * 1e6
+
+        print 'words indexed:        {}'.format(len(index))
+        print 'import words.py:      {:.2f} ms'.format(import_ms)
+        print 'build index:          {:.1f} ms'.format(load_ms)
+        print 'index memory:         {:.0f} KB'.format(index_bytes / 1024.0)
+        print 'list of str memory:   {:.0f} KB'.format(plain_bytes / 1024.0)
+        print 'choose(8, HARD):      {:.2f} us'.format(sample_us)
+        print 'choose():             {:.2f} us'.format(any_us)
+    finally:
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
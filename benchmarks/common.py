@@ -0,0 +1,119 @@
+"""common.py - Shared set-up for the benchmark scripts. Puts the App Engine
+SDK and the Hangman app on sys.path, activates the local service stubs and
+counts the RPCs issued against them.
+
+Point APPENGINE_SDK at an unpacked python27 App Engine SDK before running."""
+
+import os
+import sys
+import collections
+import contextlib
+
+SDK_PATH = os.environ.get('APPENGINE_SDK', '/usr/local/google_appengine')
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        os.pardir, 'Hangman')
+
+
+def setup_paths():
+    """Makes the SDK, its bundled libraries and the app importable"""
+    sys.path.insert(0, SDK_PATH)
+    import dev_appserver
+    dev_appserver.fix_sys_path()
+    sys.path.insert(0, APP_PATH)
+
+
+def activate_testbed(all_services=False):
+    """Activates a testbed with strongly consistent datastore, memcache and
+    task queue stubs (ending a game queues its leaderboard merge), plus
+    mail and app identity stubs if all_services is set. Returns the Testbed
+    so callers can deactivate it."""
+    from google.appengine.datastore import datastore_stub_util
+    from google.appengine.ext import ndb, testbed
+    bed = testbed.Testbed()
+    bed.activate()
+    policy = datastore_stub_util.PseudoRandomHRConsistencyPolicy(probability=1)
+    bed.init_datastore_v3_stub(consistency_policy=policy)
+    bed.init_memcache_stub()
+    bed.init_taskqueue_stub(root_path=APP_PATH)
+    if all_services:
+        bed.init_mail_stub()
+        bed.init_app_identity_stub()
+    ndb.get_context().clear_cache()
+    return bed
+
+
+@contextlib.contextmanager
+def rate_limits_disabled():
+    """Turns off Hangman.DEFAULTS['rate_limits'] for the block. Calls made
+    directly on a HangmanApi all share the 'local' client address, so a
+    benchmark would otherwise mostly measure rejected requests."""
+    from models import Hangman
+    limits = Hangman.DEFAULTS['rate_limits']
+    Hangman.DEFAULTS['rate_limits'] = {}
+    try:
+        yield
+    finally:
+        Hangman.DEFAULTS['rate_limits'] = limits
+
+
+class RpcCounter(object):
+    """Post-call hook counting RPCs per (service, call)"""
+
+    def __init__(self):
+        self.calls = collections.Counter()
+
+    def record(self, service, call, request, response):
+        self.calls[(service, call)] += 1
+
+    def install(self):
+        # the hook list inspects the hook's arguments, so it must be a
+        # function or method rather than a callable object
+        from google.appengine.api import apiproxy_stub_map
+        apiproxy_stub_map.apiproxy.GetPostCallHooks().Append(
+            'benchmark_rpc_counter', self.record)
+
+    def reset(self):
+        self.calls.clear()
+
+    def total(self, service='datastore_v3'):
+        return sum(count for (svc, _), count in self.calls.items()
+                   if svc == service)
+
+
+class ThreadRpcRecorder(object):
+    """Post-call hook recording, per thread, the datastore RPCs issued and
+    the bytes of entity data they moved (Put requests, Get and query
+    responses)"""
+
+    def __init__(self):
+        import threading
+        self._local = threading.local()
+
+    def record(self, service, call, request, response):
+        if service != 'datastore_v3':
+            return
+        local = self._local
+        local.rpcs = getattr(local, 'rpcs', 0) + 1
+        payload = request if call == 'Put' else response
+        local.bytes = getattr(local, 'bytes', 0) + payload.ByteSize()
+
+    def install(self):
+        from google.appengine.api import apiproxy_stub_map
+        apiproxy_stub_map.apiproxy.GetPostCallHooks().Append(
+            'benchmark_rpc_recorder', self.record)
+
+    def take(self):
+        """Returns (rpcs, bytes) recorded by this thread since the last
+        call and starts over"""
+        local = self._local
+        result = (getattr(local, 'rpcs', 0), getattr(local, 'bytes', 0))
+        local.rpcs = local.bytes = 0
+        return result
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    index = max(0, int(round(fraction * len(sorted_values))) - 1)
+    return sorted_values[min(index, len(sorted_values) - 1)]
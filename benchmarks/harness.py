@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+
+"""harness.py - Load-test and benchmark harness for the Hangman API. Runs
+HangmanApi in-process against the local datastore, memcache, task queue and
+mail stubs and drives a mixed workload: each simulated player runs
+create_user, then plays games (new_game and a stream of make_move), checking
+get_game, get_user_games, get_high_scores and get_user_rankings along the
+way. Players are spread over worker threads.
+
+Per endpoint it reports p50/p95/p99 latency, datastore RPCs and entity
+bytes per call as JSON. Pass --baseline with an earlier report to print the
+change of each figure.
+
+Usage: python harness.py [--players N] [--games N] [--concurrency N]
+                         [--seed N] [--output FILE] [--baseline FILE]"""
+
+import argparse
+import collections
+import json
+import random
+import sys
+import threading
+import time
+
+import common
+
+WORDS = ['HANGMAN', 'PYTHON', 'DATASTORE', 'ENDPOINTS', 'MEMCACHE', 'QUEUE',
+         'JAZZ', 'RHYTHM', 'BOOKKEEPER', 'ZYZZYVA', 'LIGHTHOUSE', 'QUIZ']
+# guess order of an average player: most frequent English letters first
+LETTERS = 'ETAOINSHRDLCUMWFGYPBVKJXQZ'
+
+
+class Recorder(object):
+    """Collects per-endpoint samples from all worker threads"""
+
+    def __init__(self, rpc_recorder):
+        self.rpc_recorder = rpc_recorder
+        self.samples = collections.defaultdict(list)
+        self.errors = collections.Counter()
+        self.lock = threading.Lock()
+
+    def call(self, name, method, request):
+        self.rpc_recorder.take()
+        start = time.time()
+        try:
+            return method(request)
+        except Exception:
+            with self.lock:
+                self.errors[name] += 1
+            return None
+        finally:
+            elapsed_ms = (time.time() - start) * 1000.0
+            rpcs, data_bytes = self.rpc_recorder.take()
+            with self.lock:
+                self.samples[name].append((elapsed_ms, rpcs, data_bytes))
+
+    def report(self):
+        endpoints = {}
+        for name, samples in sorted(self.samples.items()):
+            latencies = sorted(sample[0] for sample in samples)
+            endpoints[name] = {
+                'calls': len(samples),
+                'errors': self.errors[name],
+                'p50_ms': round(common.percentile(latencies, 0.50), 3),
+                'p95_ms': round(common.percentile(latencies, 0.95), 3),
+                'p99_ms': round(common.percentile(latencies, 0.99), 3),
+                'rpcs_per_call': round(
+                    sum(s[1] for s in samples) / float(len(samples)), 2),
+                'bytes_per_call': round(
+                    sum(s[2] for s in samples) / float(len(samples)), 1),
+            }
+        return endpoints
+
+
+def play(service, recorder, player, game_count, rng):
+    import api as api_module
+    from models import User
+    call = recorder.call
+    name = 'player{}'.format(player)
+    call('create_user', service.create_user,
+         api_module.USER_REQUEST.combined_message_class(
+             user_name=name, email='{}@example.com'.format(name)))
+    user_key = User.key_for(name).urlsafe()
+    for _ in range(game_count):
+        game = call('new_game', service.new_game,
+                    api_module.NEW_GAME_REQUEST.combined_message_class(
+                        user_name=name, word=rng.choice(WORDS)))
+        if not game:
+            continue
+        game_key = game.urlsafe_key
+        for letter in LETTERS:
+            game = call('make_move', service.make_move,
+                        api_module.MAKE_MOVE_REQUEST.combined_message_class(
+                            urlsafe_game_key=game_key, guess=letter))
+            if not game or game.game_over:
+                break
+            if rng.random() < 0.2:
+                call('get_game', service.get_game,
+                     api_module.GET_GAME_REQUEST.combined_message_class(
+                         urlsafe_game_key=game_key))
+        call('get_user_games', service.get_user_games,
+             api_module.GET_USER_GAMES_REQUEST.combined_message_class(
+                 urlsafe_user_key=user_key))
+        call('get_high_scores', service.get_high_scores,
+             api_module.GET_HIGH_SCORES_REQUEST.combined_message_class(
+                 number_of_results=10))
+        call('get_user_rankings', service.get_user_rankings,
+             api_module.PAGE_REQUEST.combined_message_class(page_size=10))
+
+
+def run(options):
+    from api import HangmanApi
+    bed = common.activate_testbed(all_services=True)
+    try:
+        rpc_recorder = common.ThreadRpcRecorder()
+        rpc_recorder.install()
+        recorder = Recorder(rpc_recorder)
+        service = HangmanApi()
+
+        def worker(players, seed):
+            rng = random.Random(seed)
+            for player in players:
+                play(service, recorder, player, options.games, rng)
+
+        threads = [threading.Thread(
+                       target=worker,
+                       args=(range(i, options.players, options.concurrency),
+                             options.seed + i))
+                   for i in range(options.concurrency)]
+        start = time.time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return {
+            'config': vars(options),
+            'wall_seconds': round(time.time() - start, 3),
+            'endpoints': recorder.report(),
+        }
+    finally:
+        bed.deactivate()
+
+
+def compare(report, baseline):
+    """Prints the relative change of each figure against a baseline run"""
+    for name, figures in sorted(report['endpoints'].items()):
+        before = baseline.get('endpoints', {}).get(name)
+        if not before:
+            continue
+        changes = []
+        for figure in ('p50_ms', 'p99_ms', 'rpcs_per_call', 'bytes_per_call'):
+            if before[figure]:
+                change = (figures[figure] - before[figure]) / before[figure]
+                changes.append('{} {:+.1%}'.format(figure, change))
+        print >> sys.stderr, '{:<18} {}'.format(name, ', '.join(changes))
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--players', type=int, default=50)
+    parser.add_argument('--games', type=int, default=5,
+                        help='games per player')
+    parser.add_argument('--concurrency', type=int, default=4,
+                        help='worker threads')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write the JSON report here')
+    parser.add_argument('--baseline', help='JSON report to compare against')
+    options = parser.parse_args(argv)
+
+    common.setup_paths()
+    output, baseline = options.output, options.baseline
+    del options.output, options.baseline
+    with common.rate_limits_disabled():
+        report = run(options)
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if output:
+        with open(output, 'w') as f:
+            f.write(text)
+    else:
+        print text
+    if baseline:
+        with open(baseline) as f:
+            compare(report, json.load(f))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+
+"""loadtest_end_game.py - Finishes many games of one user in parallel through
+make_move and checks that the UserRecord totals come out exact, with and
+without counter shards.
+
+Usage: python loadtest_end_game.py [games] [threads] [shards]"""
+
+import sys
+import threading
+import time
+
+import common
+
+
+def run(game_count, thread_count, shards):
+    import endpoints
+    from google.appengine.ext import ndb
+    from api import HangmanApi, MAKE_MOVE_REQUEST
+    from models import User, Game, UserRecord
+
+    bed = common.activate_testbed()
+    try:
+        user = User.create('hot')
+        user_record = UserRecord.key_for(user.key).get()
+        user_record.shards = shards
+        user_record.put()
+        # one-letter words, so a single guess finishes each game
+        keys = [Game.new_game(user.key, 'a').key.urlsafe()
+                for _ in range(game_count)]
+
+        api = HangmanApi()
+        errors = []
+        lock = threading.Lock()
+
+        def worker(chunk):
+            for urlsafe_key in chunk:
+                request = MAKE_MOVE_REQUEST.combined_message_class(
+                    urlsafe_game_key=urlsafe_key, guess='a')
+                try:
+                    api.make_move(request)
+                except Exception, e:
+                    with lock:
+                        errors.append(e)
+
+        threads = [threading.Thread(target=worker,
+                                    args=(keys[i::thread_count],))
+                   for i in range(thread_count)]
+        start = time.time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.time() - start
+
+        # this thread's context still caches the record put above
+        ndb.get_context().clear_cache()
+        user_record = UserRecord.key_for(user.key).get().fold_shards()
+        finished = Game.query(Game.game_over == True).count()
+        return {'games': game_count, 'finished': finished,
+                'errors': len(errors),
+                # contended endings the client is asked to retry
+                'conflicts': len([e for e in errors if isinstance(
+                    e, endpoints.ConflictException)]),
+                'recorded': user_record.games,
+                'wins': user_record.wins, 'seconds': round(elapsed, 3),
+                'exact': user_record.games == finished}
+    finally:
+        bed.deactivate()
+
+
+def main(argv):
+    common.setup_paths()
+    game_count = int(argv[0]) if len(argv) > 0 else 200
+    thread_count = int(argv[1]) if len(argv) > 1 else 16
+    shard_counts = [int(argv[2])] if len(argv) > 2 else [0, 8]
+    for shards in shard_counts:
+        with common.rate_limits_disabled():
+            result = run(game_count, thread_count, shards)
+        print 'shards={0}: {1}'.format(shards, result)
+        if not result['exact']:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
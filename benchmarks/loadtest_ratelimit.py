@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+
+"""loadtest_ratelimit.py - Well-behaved players make one move every PACE
+seconds while abusers, each from its own client address, flood make_move,
+new_game and create_user without backing off. Runs once without abusers,
+then with abusers with rate limiting off and on, and reports the players'
+make_move latency percentiles, the abusers' accepted and rejected calls and
+the datastore puts they caused.
+
+Usage: python loadtest_ratelimit.py [players] [abusers] [seconds]"""
+
+import importlib
+import string
+import sys
+import threading
+import time
+
+import common
+
+PACE = 0.6
+
+
+def service(address):
+    """Returns a HangmanApi whose requests come from address"""
+    from protorpc import remote
+    from api import HangmanApi
+    api = HangmanApi()
+    api.initialize_request_state(remote.HttpRequestState(
+        remote_address=address, remote_host=None, server_host='localhost',
+        server_port=8080))
+    return api
+
+
+def new_game(api, name):
+    from api import NEW_GAME_REQUEST
+    return api.new_game(NEW_GAME_REQUEST.combined_message_class(
+        user_name=name, word=string.ascii_uppercase)).urlsafe_key
+
+
+def player(index, stop, latencies, lock):
+    from api import MAKE_MOVE_REQUEST, USER_REQUEST
+    api = service('10.0.0.{}'.format(index))
+    name = 'player{}'.format(index)
+    api.create_user(USER_REQUEST.combined_message_class(user_name=name))
+    game_key, guesses = new_game(api, name), list(string.ascii_uppercase)
+    while not stop.is_set():
+        if not guesses:
+            game_key, guesses = new_game(api, name), list(string.ascii_uppercase)
+        request = MAKE_MOVE_REQUEST.combined_message_class(
+            urlsafe_game_key=game_key, guess=guesses.pop(0))
+        start = time.time()
+        api.make_move(request)
+        with lock:
+            latencies.append((time.time() - start) * 1000.0)
+        stop.wait(PACE)
+
+
+def abuser(index, stop, counts, lock):
+    import endpoints
+    from api import MAKE_MOVE_REQUEST, USER_REQUEST
+    api = service('10.1.0.{}'.format(index))
+    name = 'abuser{}'.format(index)
+    api.create_user(USER_REQUEST.combined_message_class(user_name=name))
+    game_key, guesses, serial = None, [], 0
+    while not stop.is_set():
+        serial += 1
+        try:
+            if serial % 10 == 0:
+                api.create_user(USER_REQUEST.combined_message_class(
+                    user_name='{}-{}'.format(name, serial)))
+            elif not guesses:
+                game_key = new_game(api, name)
+                guesses = list(string.ascii_uppercase)
+            else:
+                api.make_move(MAKE_MOVE_REQUEST.combined_message_class(
+                    urlsafe_game_key=game_key, guess=guesses.pop(0)))
+            outcome = 'accepted'
+        except endpoints.ServiceException, e:
+            outcome = 'rejected' if e.http_status == 503 else 'failed'
+        with lock:
+            counts[outcome] += 1
+
+
+def run(players, abusers, seconds, limited):
+    from models import Hangman
+    bed = common.activate_testbed()
+    limits = Hangman.DEFAULTS['rate_limits']
+    if not limited:
+        Hangman.DEFAULTS['rate_limits'] = {}
+    try:
+        counter = common.RpcCounter()
+        counter.install()
+        stop = threading.Event()
+        lock = threading.Lock()
+        latencies = []
+        counts = {'accepted': 0, 'rejected': 0, 'failed': 0}
+        threads = [threading.Thread(target=player,
+                                    args=(i, stop, latencies, lock))
+                   for i in range(players)]
+        threads += [threading.Thread(target=abuser,
+                                     args=(i, stop, counts, lock))
+                    for i in range(abusers)]
+        for thread in threads:
+            thread.start()
+        time.sleep(seconds)
+        stop.set()
+        for thread in threads:
+            thread.join()
+        latencies.sort()
+        return {
+            'moves': len(latencies),
+            'p50': common.percentile(latencies, 0.50),
+            'p99': common.percentile(latencies, 0.99),
+            'abuser_calls': counts,
+            'puts': counter.calls[('datastore_v3', 'Put')],
+        }
+    finally:
+        Hangman.DEFAULTS['rate_limits'] = limits
+        bed.deactivate()
+
+
+def main(argv):
+    common.setup_paths()
+    players = int(argv[0]) if argv else 10
+    abusers = int(argv[1]) if len(argv) > 1 else 4
+    seconds = float(argv[2]) if len(argv) > 2 else 10
+    # Endpoints reads the app version when api is first imported, which
+    # fails under the testbed's environment, so load it before any run
+    importlib.import_module('api')
+    print '{:>22} {:>6} {:>9} {:>9} {:>9} {:>9} {:>7}'.format(
+        'scenario', 'moves', 'p50 ms', 'p99 ms', 'accepted', 'rejected',
+        'puts')
+    for label, abuser_count, limited in (
+            ('players only', 0, True),
+            ('abusers, no limits', abusers, False),
+            ('abusers, rate limited', abusers, True)):
+        result = run(players, abuser_count, seconds, limited)
+        calls = result['abuser_calls']
+        print '{:>22} {:>6} {:>9.2f} {:>9.2f} {:>9} {:>9} {:>7}'.format(
+            label, result['moves'], result['p50'], result['p99'],
+            calls['accepted'], calls['rejected'], result['puts'])
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
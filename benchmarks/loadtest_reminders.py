@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+
+"""loadtest_reminders.py - Runs the hourly reminder cron end to end against
+the task queue and mail stubs: the fan-out over pages of Users, the send
+batches and a retried batch. Checks that the expected named tasks were
+queued and that every User with an email and active games got exactly one
+digest.
+
+Usage: python loadtest_reminders.py [users]"""
+
+import sys
+import time
+
+import common
+
+
+def seed(user_count):
+    """Creates Users, every third without an email and every fourth without
+    an active game. Returns the emails that should get a digest."""
+    from models import User, Game
+    expected = set()
+    for i in range(user_count):
+        email = None if i % 3 == 0 else 'user{}@example.com'.format(i)
+        user = User.create('user{}'.format(i), email)
+        game = Game.new_game(user.key, 'HANGMAN')
+        if i % 4 == 0:
+            game.game_over = True
+            game.put()
+        elif email:
+            expected.add(email)
+    return expected
+
+
+def execute(app, task):
+    """Runs a push task through the app as the queue would"""
+    response = app.get_response(
+        task.url, method='POST', body=task.payload,
+        headers={'Content-Type': 'application/x-www-form-urlencoded'})
+    if response.status_int != 200:
+        raise RuntimeError('{} failed: {}'.format(task.name, response.status))
+
+
+def drain(app, taskqueue_stub, queue_name):
+    """Runs the tasks of a queue until it is empty, including the tasks
+    they enqueue. Returns the tasks run."""
+    run = []
+    while True:
+        tasks = taskqueue_stub.get_filtered_tasks(queue_names=[queue_name])
+        if not tasks:
+            return run
+        for task in tasks:
+            execute(app, task)
+            taskqueue_stub.DeleteTask(queue_name, task.name)
+            run.append(task)
+
+
+def run(user_count):
+    from google.appengine.ext import testbed
+    import main
+
+    bed = common.activate_testbed(all_services=True)
+    try:
+        expected = seed(user_count)
+        taskqueue_stub = bed.get_stub(testbed.TASKQUEUE_SERVICE_NAME)
+        mail_stub = bed.get_stub(testbed.MAIL_SERVICE_NAME)
+
+        start = time.time()
+        response = main.app.get_response('/crons/send_reminder')
+        if response.status_int != 200:
+            raise RuntimeError('cron failed: {}'.format(response.status))
+        tasks = drain(main.app, taskqueue_stub, main.REMINDER_QUEUE)
+        elapsed = time.time() - start
+
+        # a send batch retried after it went through mails nobody twice
+        sends = [task for task in tasks if '-send-' in task.name]
+        if sends:
+            execute(main.app, sends[0])
+
+        # names are reminders-{run_id}-{page|send}-{page number}
+        steps = [task.name.split('-', 2)[2] for task in tasks]
+        pages = len([step for step in steps if step.startswith('page-')])
+        # every User is paged, a full last page may leave a cursor and so
+        # one empty page
+        send_pages = -(-user_count // main.FanOutReminders.PAGE_SIZE)
+        expected_steps = set(['page-{}'.format(page) for page in range(pages)] +
+                             ['send-{}'.format(page)
+                              for page in range(send_pages)])
+        recipients = [message.to for message in mail_stub.get_sent_messages()]
+        return {'users': user_count, 'tasks': len(tasks),
+                'mails': len(recipients), 'expected_mails': len(expected),
+                'seconds': round(elapsed, 3),
+                'tasks_ok': (set(steps) == expected_steps and
+                             len(steps) == len(expected_steps) and
+                             send_pages <= pages <= send_pages + 1),
+                'mails_ok': sorted(recipients) == sorted(expected)}
+    finally:
+        bed.deactivate()
+
+
+def main(argv):
+    common.setup_paths()
+    user_count = int(argv[0]) if argv else 250
+    result = run(user_count)
+    print result
+    if not (result['tasks_ok'] and result['mails_ok']):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])